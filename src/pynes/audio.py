@@ -0,0 +1,245 @@
+"""
+PyNES - Audio output
+
+The APU produces one sample per APU cycle. BlipBuffer brings that down to the output rate by band-limited step
+synthesis: the signal is only ever a series of steps, so each change in level is added to the output as a windowed
+sinc step at its exact fractional position. RingBuffer then hands the samples to a playback callback without locks,
+and AudioCapture streams them to a file.
+"""
+
+import hashlib
+import logging
+import queue
+import threading
+import wave
+import numpy as np
+from papu import SAMPLE_RATE
+
+__author__ = 'misha'
+
+log = logging.getLogger("PyNES")
+
+# Taps of the band-limited impulse, and the fractional positions it is tabulated for.
+KERNEL_WIDTH = 16
+KERNEL_PHASES = 64
+# Cutoff as a fraction of the output rate, just under Nyquist.
+CUTOFF = 0.45
+# How quickly the DC offset of the mixer output is tracked, per block. The correction moves linearly within a block.
+DC_TRACKING = 0.05
+
+
+def to_pcm(samples, volume=1.0):
+    """
+    Convert float samples centred on zero to signed 16-bit little-endian PCM.
+    """
+    samples = samples * (32767 * volume)
+    np.clip(samples, -32768, 32767, out=samples)
+    return samples.astype('<i2')
+
+
+def step_kernel(width, phases, cutoff):
+    """
+    Windowed sinc impulses, one row per fractional position, each summing to one so a step lands at its full height.
+    Row p, tap k is the impulse at k - width / 2 - p / phases output samples from the step.
+    """
+    offsets = np.arange(width) - width // 2 - np.arange(phases)[:, None] / phases
+    kernel = np.sinc(2 * cutoff * offsets) * np.blackman(width + 2)[1:-1]
+    return (kernel / kernel.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+class BlipBuffer:
+    """
+    Resample blocks of APU output to `rate` through band-limited steps. Output lags input by KERNEL_WIDTH / 2
+    samples.
+    """
+    def __init__(self, rate, input_rate=SAMPLE_RATE):
+        self.rate = rate
+        self._ratio = rate / input_rate
+        self._kernel = step_kernel(KERNEL_WIDTH, KERNEL_PHASES, CUTOFF)
+        self._taps = np.arange(KERNEL_WIDTH)
+        # Output position of the next input sample, as a fraction of an output sample.
+        self._phase = 0.0
+        # Last input sample and last output level, so steps are continuous across blocks.
+        self._last = 0.0
+        self._level = 0.0
+        self._dc = 0.0
+        # Impulses that fall after the end of the block just emitted.
+        self._tail = np.zeros(KERNEL_WIDTH, dtype=np.float64)
+
+    def resample(self, samples):
+        """
+        Turn a block of input samples into as many output samples as it covers, as float32 centred on zero.
+        """
+        n = len(samples)
+        end = self._phase + n * self._ratio
+        count = int(end)
+
+        deltas = np.diff(samples, prepend=np.float32(self._last))
+        self._last = samples[-1] if n else self._last
+        changes = np.flatnonzero(deltas)
+        positions = self._phase + changes * self._ratio
+        starts = positions.astype(np.intp)
+        phases = ((positions - starts) * KERNEL_PHASES).astype(np.intp)
+        self._phase = end - count
+
+        impulses = np.bincount((starts[:, None] + self._taps).ravel(),
+                               weights=(deltas[changes, None] * self._kernel[phases]).ravel(),
+                               minlength=count + KERNEL_WIDTH).astype(np.float64, copy=False)
+        impulses[:KERNEL_WIDTH] += self._tail
+        self._tail = impulses[count:count + KERNEL_WIDTH]
+
+        output = np.cumsum(impulses[:count])
+        output += self._level
+        if count:
+            self._level = output[-1]
+            dc = self._dc + (output.mean() - self._dc) * DC_TRACKING
+            # Ramp the correction across the block, so it never steps at a block boundary.
+            output -= self._dc + (dc - self._dc) * (np.arange(1, count + 1) / count)
+            self._dc = dc
+        return output.astype(np.float32)
+
+
+class RingBuffer:
+    """
+    Fixed-size single-producer, single-consumer sample queue. The emulator writes and a playback callback reads;
+    each side only ever moves its own position, so neither takes a lock or waits on the other. Samples that do not
+    fit are dropped and counted as an overrun; a read that comes up short is padded with silence and counted as an
+    underrun.
+    """
+    def __init__(self, capacity, dtype=np.int16):
+        self.capacity = capacity
+        self._samples = np.zeros(capacity, dtype=dtype)
+        # Total samples ever written and read. Only the writer moves _written and only the reader moves _read.
+        self._written = 0
+        self._read = 0
+        self.overruns = 0
+        self.underruns = 0
+
+    def __len__(self):
+        return self._written - self._read
+
+    def write(self, samples):
+        """
+        Queue as many samples as fit. Returns the number queued.
+        """
+        free = self.capacity - (self._written - self._read)
+        if len(samples) > free:
+            self.overruns += 1
+            samples = samples[:free]
+        count = len(samples)
+        start = self._written % self.capacity
+        first = min(count, self.capacity - start)
+        self._samples[start:start + first] = samples[:first]
+        self._samples[:count - first] = samples[first:]
+        # Publish only once the samples are in place.
+        self._written += count
+        return count
+
+    def read(self, count):
+        """
+        Take `count` samples, padded with silence if fewer are queued.
+        """
+        out = np.zeros(count, dtype=self._samples.dtype)
+        available = min(count, self._written - self._read)
+        if available < count:
+            self.underruns += 1
+        start = self._read % self.capacity
+        first = min(available, self.capacity - start)
+        out[:first] = self._samples[start:start + first]
+        out[first:available] = self._samples[:available - first]
+        self._read += available
+        return out
+
+
+class AudioOutput:
+    """
+    Resample the APU's output to `rate` and queue it as signed 16-bit mono samples for playback.
+    """
+    def __init__(self, apu, rate=44100, latency=0.25, volume=1.0):
+        self.rate = rate
+        self.volume = volume
+        self.blip = BlipBuffer(rate)
+        self.ring = RingBuffer(int(rate * latency))
+        apu.add_sample_listener(self.samples)
+
+    def samples(self, samples):
+        self.ring.write(to_pcm(self.blip.resample(samples), self.volume))
+
+    def read(self, count):
+        return self.ring.read(count)
+
+
+class AudioCapture:
+    """
+    Stream the APU output at `rate` to a WAV file, or to raw signed 16-bit little-endian mono PCM for any name not
+    ending in .wav. Samples are gathered into chunks of `chunk` seconds on the emulation thread and written by a
+    background thread. At most `queued` chunks wait for it; if the disk falls that far behind, chunks are dropped
+    and counted rather than stalling emulation.
+
+    Every block the APU hands over (one per frame when run frame by frame) is hashed into `digest` once it is
+    written, so the hashes only ever describe samples in the file. With `hashes`, the hash of each block is also
+    written to that file, one hex line per block.
+    """
+    def __init__(self, apu, filename, rate=44100, hashes=None, chunk=1.0, queued=8):
+        self.rate = rate
+        self.blip = BlipBuffer(rate)
+        self.digest = hashlib.sha1()
+        self.dropped = 0
+        self._chunk = int(rate * chunk)
+        self._pending = []
+        self._pending_samples = 0
+        self._queue = queue.Queue(queued)
+
+        if filename.endswith('.wav'):
+            self._file = wave.open(filename, 'wb')
+            self._file.setnchannels(1)
+            self._file.setsampwidth(2)
+            self._file.setframerate(rate)
+            self._write = self._file.writeframesraw
+        else:
+            self._file = open(filename, 'wb')
+            self._write = self._file.write
+        self._hashes = open(hashes, 'w') if hashes else None
+
+        self._thread = threading.Thread(target=self._drain, name="AudioCapture", daemon=True)
+        self._thread.start()
+        apu.add_sample_listener(self.samples)
+
+    def samples(self, samples):
+        pcm = to_pcm(self.blip.resample(samples)).tobytes()
+        self._pending.append(pcm)
+        self._pending_samples += len(pcm) // 2
+        if self._pending_samples >= self._chunk:
+            self._send(block=False)
+
+    def _send(self, block):
+        try:
+            self._queue.put(self._pending, block=block)
+        except queue.Full:
+            if not self.dropped:
+                log.warning("Audio capture is falling behind, dropping samples.")
+            self.dropped += self._pending_samples
+        self._pending = []
+        self._pending_samples = 0
+
+    def _drain(self):
+        while True:
+            blocks = self._queue.get()
+            if blocks is None:
+                break
+            self._write(b"".join(blocks))
+            for pcm in blocks:
+                self.digest.update(pcm)
+            if self._hashes is not None and blocks:
+                self._hashes.write("".join(hashlib.sha1(pcm).hexdigest() + "\n" for pcm in blocks))
+
+    def close(self):
+        """
+        Write out everything captured so far and close the files.
+        """
+        self._send(block=True)
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if self._hashes is not None:
+            self._hashes.close()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+PyNES - CPU interpreter benchmark
+
+Runs the same ROM for the same number of CPU cycles through the CPU.Instruction objects, the generated per-opcode
+handlers and the basic-block translation cache, and reports instructions per second for each.
+"""
+
+import argparse
+import time
+from cartridge import Cartridge
+from console import Console
+from cpu.blocks import BlockCache
+
+ENGINES = ('execute', 'dispatch', 'blocks')
+
+
+def measure(romfile, engine, cycles):
+    """
+    Run `cycles` CPU cycles with the given engine. Returns the elapsed time and the number of steps taken.
+    """
+    console = Console(Cartridge(romfile))
+    cpu = console.CPU
+    if engine == 'blocks':
+        cpu.blocks = BlockCache(cpu)
+    else:
+        cpu.interpreter = getattr(cpu, engine)
+    step = cpu.step
+    steps = 0
+
+    def counted_step():
+        nonlocal steps
+        steps += 1
+        return step()
+    cpu.step = counted_step
+
+    start = time.perf_counter()
+    console.scheduler.run_until(cycles)
+    return time.perf_counter() - start, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU interpreter throughput for PyNES")
+    parser.add_argument('romfile', metavar="filename", type=str, help="The ROM file to run")
+    parser.add_argument('--cycles', type=int, default=1000000, help="CPU cycles to emulate per run")
+    args = parser.parse_args()
+
+    # The block engine takes one step per block, so use the instruction count from the interpreter runs.
+    instructions = None
+    baseline = None
+    for engine in ENGINES:
+        seconds, steps = measure(args.romfile, engine, args.cycles)
+        instructions = instructions or steps
+        baseline = baseline or seconds
+        print("{0:>10}: {1:12,.0f} instructions/sec  {2:6.2f}x".format(engine, instructions / seconds,
+                                                                      baseline / seconds))
+
+
+if __name__ == "__main__":
+    main()
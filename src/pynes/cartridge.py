@@ -10,13 +10,6 @@ class Cartridge:
             self.load(filename)
         self._mapper_id = 0
 
-    def __getattr__(self, name):
-        if name == "prg_rom":
-            pages = self.mapper.loaded_pages
-            lower_page = self._prg_rom[pages[0] * 0x4000:(pages[0] + 1) * 0x4000]
-            upper_page = self._prg_rom[pages[1] * 0x4000:(pages[1] + 1) * 0x4000]
-            return lower_page + upper_page
-
     def load(self, file):
         log.debug("Reading cartridge '{0}'...".format(file))
         with open(file, "rb") as f:
@@ -29,9 +22,14 @@ class Cartridge:
 
             # Read PRG ROM
             self._prg_rom = f.read(self._prg_rom_pages * 0x4000)
+            self._prg_view = memoryview(self._prg_rom)
+
+            # Read CHR ROM. Carts without any use 8KB of CHR RAM instead.
+            self.chr_rom = f.read(self._chr_rom_pages * 0x2000)
+            self._chr_view = memoryview(self.chr_rom)
 
-            # Read CHR ROM
-            self._chr_rom = f.read(self._chr_rom_pages * 0x2000)
+        self.load_mapper()
+        log.debug("Uses mapper: {0}".format(self.mapper.__class__))
 
     def _parse_header(self, header):
         # Verify legal header.
@@ -45,6 +43,8 @@ class Cartridge:
         log.debug("Character ROM pages: {0}".format(self._chr_rom_pages))
         self._flags6 = header[6]
         self._flags7 = header[7]
+        self.vertical_mirroring = bool(self._flags6 & 0b1)
+        self.four_screen = bool(self._flags6 & 0b1000)
 
         if self._flags7 & 0b100:
             # NES 2.0 format
@@ -57,19 +57,18 @@ class Cartridge:
 
         # Determine mapper ID
         self._mapper_id = self._flags6 >> 4
-        if header[11:15] is b"\x00\x00\x00\x00":
+        if header[11:15] == b"\x00\x00\x00\x00":
             self._mapper_id += (self._flags7 >> 4) << 4
-        self.load_mapper()
-        log.debug("Uses mapper: {0}".format(self.mapper.__class__))
 
     def read_prg(self, pc, byte_count):
         return self._prg_rom[pc:pc + byte_count]
 
     def load_mapper(self):
-        if self._mapper_id == 1:
-            self.mapper = MMC1(self)
-        else:
+        if self._mapper_id not in MAPPERS:
             raise Exception("Memory mapper ID #" + str(self._mapper_id) + " not yet implemented.")
+        self.mapper = MAPPERS[self._mapper_id](self)
+        # 16KB views into PRG ROM for $8000 and $c000, kept up to date by the mapper
+        self.prg_banks = self.mapper.prg_banks
 
     def mem_write(self, address, value):
         self.mapper.mem_write(address, value)
\ No newline at end of file
@@ -1,14 +1,39 @@
 __author__ = 'misha'
 
+import time
 from cpu import CPU
+from papu import Papu
 from ppu import PPU
+from scheduler import Scheduler
 
 class Console:
     def __init__(self, cart):
         self.Cart = cart
         self.CPU = CPU(self)
         self.PPU = PPU(self)
+        self.APU = Papu(self)
+        self.scheduler = Scheduler(self)
 
-    def boot(self):
-        self.CPU.start()
-        self.PPU.start()
+    def close(self):
+        """
+        Release anything the console started outside this process.
+        """
+        self.PPU.stop_worker()
+
+    def run_frame(self):
+        """
+        Emulate one video frame on the calling thread. Returns the CPU cycles emulated.
+        """
+        return self.scheduler.run_frame()
+
+    def run_frames(self, frames):
+        """
+        Run the console unthrottled for the given number of frames. Returns the wall-clock seconds taken and the CPU
+        cycles emulated.
+        """
+        run_frame = self.scheduler.run_frame
+        cycles = 0
+        start = time.perf_counter()
+        for _ in range(frames):
+            cycles += run_frame()
+        return time.perf_counter() - start, cycles
@@ -3,6 +3,9 @@ ABSOLUTE addressing mode
 """
 size = 2
 
+# Inline source used by cpu.codegen
+address_template = "param"
+
 
 def read(cpu, param):
     return cpu.memory.read(param)
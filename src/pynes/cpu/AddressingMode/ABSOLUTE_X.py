@@ -3,13 +3,16 @@ Indexed absolute addressing with X-Register
 """
 size = 2
 
+# Inline source used by cpu.codegen
+address_template = "(param + registers.x) & 0xffff"
+
 
 def read(cpu, param):
-    return cpu.memory.read(param + cpu.registers['x'].read())
+    return cpu.memory.read((param + cpu.registers.x) & 0xffff)
 
 
 def write(cpu, param, value):
-    cpu.memory.write(param + cpu.registers['x'].read(), value)
+    cpu.memory.write((param + cpu.registers.x) & 0xffff, value)
 
 
 def print(param):
@@ -3,13 +3,16 @@ Indexed addressing with Y-Register
 """
 size = 2
 
+# Inline source used by cpu.codegen
+address_template = "(param + registers.y) & 0xffff"
+
 
 def read(cpu, param):
-    return cpu.memory.read(param + cpu.registers['y'].read())
+    return cpu.memory.read((param + cpu.registers.y) & 0xffff)
 
 
 def write(cpu, param, value):
-    cpu.memory.write(param + cpu.registers['y'].read(), value)
+    cpu.memory.write((param + cpu.registers.y) & 0xffff, value)
 
 
 def print(param):
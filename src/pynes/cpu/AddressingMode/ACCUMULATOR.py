@@ -3,13 +3,17 @@ Accumulator based addressing
 """
 size = 0
 
+# Inline source used by cpu.codegen
+value_template = "registers.a"
+store_template = "registers.a = {0}"
+
 
 def read(cpu, *args):
-    return cpu.registers['a'].read()
+    return cpu.registers.a
 
 
 def write(cpu, param, value):
-    cpu.registers['a'].write(value)
+    cpu.registers.a = value
 
 
 def print(param):
@@ -3,6 +3,9 @@ Immediate addressing
 """
 size = 1
 
+# Inline source used by cpu.codegen
+value_template = "param"
+
 
 def read(cpu, param):
     return param
@@ -3,6 +3,9 @@ Indirect addressing for JMP instructions
 """
 size = 2
 
+# Inline source used by cpu.codegen
+value_template = "read(param) | (read(param + 1) << 8)"
+
 
 def read(cpu, param):
     low_bit = cpu.memory.read(param)
@@ -3,18 +3,21 @@ Pre-indexed Indirect addressing with X-Register
 """
 size = 1
 
+# Inline source used by cpu.codegen
+address_template = "read((param + registers.x) & 0xff) | (read((param + registers.x + 1) & 0xff) << 8)"
+
 
 def read(cpu, param):
-    indirect_address = (param + cpu.registers['x'].read()) & 0xff
+    indirect_address = (param + cpu.registers.x) & 0xff
     address = cpu.memory.read(indirect_address)
-    address += (cpu.memory.read(indirect_address + 1) << 8)
+    address += (cpu.memory.read((indirect_address + 1) & 0xff) << 8)
     return cpu.memory.read(address)
 
 
 def write(cpu, param, value):
-    indirect_address = (param + cpu.registers['x'].read()) & 0xff
+    indirect_address = (param + cpu.registers.x) & 0xff
     address = cpu.memory.read(indirect_address)
-    address += (cpu.memory.read(indirect_address + 1) << 8)
+    address += (cpu.memory.read((indirect_address + 1) & 0xff) << 8)
     cpu.memory.write(address, value)
 
 
@@ -3,17 +3,20 @@ Post-indexed indirect addressing with Y-Register
 """
 size = 1
 
+# Inline source used by cpu.codegen
+address_template = "((read(param) | (read((param + 1) & 0xff) << 8)) + registers.y) & 0xffff"
+
 
 def read(cpu, param):
     address = cpu.memory.read(param)
-    address += (cpu.memory.read(param + 1) << 8)
-    return cpu.memory.read(address + cpu.registers['y'].read())
+    address += (cpu.memory.read((param + 1) & 0xff) << 8)
+    return cpu.memory.read((address + cpu.registers.y) & 0xffff)
 
 
 def write(cpu, param, value):
     address = cpu.memory.read(param)
-    address += (cpu.memory.read(param + 1) << 8)
-    cpu.memory.write(address + cpu.registers['y'].read(), value)
+    address += (cpu.memory.read((param + 1) & 0xff) << 8)
+    cpu.memory.write((address + cpu.registers.y) & 0xffff, value)
 
 
 def print(param):
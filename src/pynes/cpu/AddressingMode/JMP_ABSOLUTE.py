@@ -3,6 +3,9 @@ Absolute addressing for JMP instructions -- 2 byte immediate value for memory lo
 """
 size = 2
 
+# Inline source used by cpu.codegen
+value_template = "param"
+
 
 def read(cpu, param):
     return param
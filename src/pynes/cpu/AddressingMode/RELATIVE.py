@@ -1,14 +1,15 @@
 """
 Relative addressing for branch instructions
 """
-import numpy as np
-
 size = 1
 
+# Inline source used by cpu.codegen
+value_template = "(param ^ 0x80) - 0x80"
+
 
 def read(cpu, param):
-    return np.int8(param)
+    return (param ^ 0x80) - 0x80
 
 
 def print(param):
-    return np.int8(param)
\ No newline at end of file
+    return str((param ^ 0x80) - 0x80)
\ No newline at end of file
@@ -3,6 +3,9 @@ Zeropage absolute addressing
 """
 size = 1
 
+# Inline source used by cpu.codegen
+address_template = "param"
+
 
 def read(cpu, param):
     return cpu.memory.read(param)
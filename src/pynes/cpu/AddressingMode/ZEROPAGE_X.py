@@ -3,14 +3,17 @@ Zero-page indexed addressing with X-Register
 """
 size = 1
 
+# Inline source used by cpu.codegen
+address_template = "(param + registers.x) & 0xff"
+
 
 def read(cpu, param):
-    address = param + cpu.registers['x'].read()
+    address = (param + cpu.registers.x) & 0xff
     return cpu.memory.read(address)
 
 
 def write(cpu, param, value):
-    address = param + cpu.registers['x'].read()
+    address = (param + cpu.registers.x) & 0xff
     cpu.memory.write(address, value)
 
 
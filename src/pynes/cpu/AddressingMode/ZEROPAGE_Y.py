@@ -3,14 +3,17 @@ Zero-page indexed addressing with Y-Register
 """
 size = 1
 
+# Inline source used by cpu.codegen
+address_template = "(param + registers.y) & 0xff"
+
 
 def read(cpu, param):
-    address = param + cpu.registers['y'].read()
+    address = (param + cpu.registers.y) & 0xff
     return cpu.memory.read(address)
 
 
 def write(cpu, param, value):
-    address = param + cpu.registers['y'].read()
+    address = (param + cpu.registers.y) & 0xff
     cpu.memory.write(address, value)
 
 
@@ -0,0 +1,152 @@
+"""
+PyNES - Basic-block translation cache
+
+Straight-line runs of PRG ROM code, up to and including the next branch or jump, are compiled into a single Python
+function that executes the whole run and returns its cycles, with the base cycles summed at translation time.
+Blocks are cached per PRG bank and start address.
+
+A block is given the cycles left until the scheduler's next boundary and stops as soon as it uses them up, so it
+never runs past the point where single steps would have stopped. An instruction that may touch anything but RAM or
+PRG ROM runs as a block of its own: the scheduler clock is then exact when the register is accessed, and any
+interrupt or bank switch it causes is seen before the next instruction.
+"""
+
+import logging
+from cpu import codegen
+
+__author__ = 'misha'
+
+log = logging.getLogger("PyNES")
+
+# Instructions that end a block because they change the flow of control.
+CONTROL_FLOW = {'BCC', 'BCS', 'BEQ', 'BMI', 'BNE', 'BPL', 'BVC', 'BVS', 'BRK', 'JMP', 'JSR', 'RTI', 'RTS'}
+
+# Instructions that end a block because they can unmask a pending IRQ, which is taken before the next instruction.
+UNMASKS = {'CLI', 'PLP'}
+
+# Modes whose effective address is always below $0800, and modes whose address is only known at run time.
+ZEROPAGE_MODES = {'ZEROPAGE', 'ZEROPAGE_X', 'ZEROPAGE_Y'}
+POINTER_MODES = {'INDIRECT_X', 'INDIRECT_Y'}
+
+MAX_BLOCK_INSTRUCTIONS = 32
+
+
+class BlockCache:
+    def __init__(self, cpu):
+        self._cpu = cpu
+        self._cart = cpu._cart
+        self._namespace = codegen.handler_namespace(cpu)
+
+        # Translated blocks by PRG bank, then by address. _active holds the tables for the banks currently mapped
+        # at $8000 and $c000 so lookups do not need to resolve the bank.
+        self._banks = {}
+        self._active = [None, None]
+        self.map_prg(0x8000, 0x10000)
+        self._cart.mapper.add_prg_listener(self.map_prg)
+
+        self.translated = 0
+
+    def map_prg(self, start, end):
+        """
+        Switch the active block tables for the PRG slots in [start, end) to the banks now loaded there.
+        """
+        for slot in range((start - 0x8000) >> 14, (end - 0x8000) >> 14):
+            self._active[slot] = self._banks.setdefault(self._cart.mapper.loaded_pages[slot], {})
+
+    def run(self, pc, budget):
+        """
+        Execute the block starting at pc, translating it first if needed, stopping early once `budget` cycles have
+        been used. Returns the cycles it took.
+        """
+        blocks = self._active[(pc >> 14) & 1]
+        block = blocks.get(pc)
+        if block is None:
+            block = blocks[pc] = self.translate(pc)
+        return block(budget)
+
+    def translate(self, pc):
+        slot = (pc >> 14) & 1
+        bank = self._cart.prg_banks[slot]
+        opcodes = self._cpu._opcodes
+
+        lines = []
+        cycles = 0
+        variable_cycles = False
+        count = 0
+        address = pc
+        ends_in_jump = False
+        while count < MAX_BLOCK_INSTRUCTIONS and (address >> 14) == (pc >> 14):
+            offset = address & 0x3fff
+            instruction = opcodes.get(bank[offset])
+            # Stop at illegal opcodes (the interpreter raises for them) and at the end of the bank.
+            if instruction is None or offset + instruction._admode.size > 0x3fff:
+                break
+
+            mnemonic = instruction._fn.__name__
+            mode = instruction._admode
+            operation = codegen.OPERATIONS[mnemonic]
+            param = 0
+            for i in range(mode.size):
+                param |= bank[offset + 1 + i] << (8 * i)
+            accesses_io = self._accesses_io(mode, param, operation)
+            if accesses_io and count:
+                break
+
+            if count:
+                # Single steps would stop here if the boundary has been reached.
+                lines.extend(["if budget <= {0}:".format(cycles),
+                              "    registers.pc = {0:#06x}".format(address),
+                              "    return {0}".format(cycles)])
+            address = (address + 1 + mode.size) & 0xffff
+            count += 1
+            cycles += instruction._cycles
+
+            if operation.uses_pc:
+                lines.append("registers.pc = {0:#06x}".format(address))
+            variable_cycles |= operation.extra_cycles is not None
+            lines.extend(codegen.operation_source(mnemonic, mode, param))
+
+            if mnemonic in CONTROL_FLOW:
+                ends_in_jump = True
+                break
+            # A register access can raise an interrupt and a mapper write can switch out the bank this block lives
+            # in. Extra cycles are only known after the last instruction.
+            if accesses_io or mnemonic in UNMASKS or variable_cycles:
+                break
+
+        if count == 0:
+            return lambda budget: self._cpu.interpreter(self._cpu.fetch(pc))
+
+        if not ends_in_jump:
+            lines.append("registers.pc = {0:#06x}".format(address))
+        source = ["def block(budget):",
+                  "    # {0} instructions from {1:#06x}".format(count, pc)]
+        if variable_cycles:
+            source.append("    cycles = {0}".format(cycles))
+        source.extend("    " + line for line in lines)
+        source.append("    return " + ("cycles" if variable_cycles else str(cycles)))
+
+        exec(compile("\n".join(source), "<block {0:#06x}>".format(pc), "exec"), self._namespace)
+        self.translated += 1
+        return self._namespace.pop('block')
+
+    @staticmethod
+    def _accesses_io(mode, param, operation):
+        """
+        Whether an instruction may access anything other than RAM, or PRG ROM when it only reads.
+        """
+        name = mode.__name__.rsplit('.', 1)[-1]
+        if hasattr(mode, 'address_template'):
+            if not operation.reads and operation.result is None:
+                return False
+        elif name != 'INDIRECT':
+            return False
+
+        if name in ZEROPAGE_MODES:
+            return False
+        if name in POINTER_MODES:
+            return True
+        last = param + {'ABSOLUTE_X': 0xff, 'ABSOLUTE_Y': 0xff, 'INDIRECT': 1}.get(name, 0)
+        if last < 0x2000:
+            return False
+        return not (param >= 0x8000 and operation.result is None)
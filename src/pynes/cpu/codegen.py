@@ -0,0 +1,204 @@
+"""
+PyNES - Specialized per-opcode handlers generated from the CPU opcode table
+
+Each handler has the operand decode, effective address calculation and the operation itself fused into one flat
+function, so dispatch is a single list index and call with no closures or (value, cycles) tuples.
+
+The operations are not written out twice: each one is the body of its function in cpu/instructions.py, rewritten so
+that `source()` becomes the addressing mode's inline operand and the returned (value, extra cycles) becomes a store
+through the addressing mode and an addition to `cycles`.
+"""
+
+import ast
+import copy
+import inspect
+import logging
+import re
+import textwrap
+from cpu import instructions
+
+__author__ = 'misha'
+
+log = logging.getLogger("PyNES")
+
+
+class Operation:
+    """
+    One instructions.py function as inline statements.
+    """
+    class Inliner(ast.NodeTransformer):
+        """
+        Point the body of an instruction function at the names the generated code runs against: `cpu.registers`
+        and its local aliases become `registers`, and `cpu.memory.read` and `cpu.memory.write` become `read` and
+        `write`.
+        """
+        def __init__(self, aliases):
+            self._aliases = aliases
+
+        def visit_Name(self, node):
+            if node.id in self._aliases:
+                return ast.copy_location(ast.Name('registers', node.ctx), node)
+            return node
+
+        def visit_Attribute(self, node):
+            self.generic_visit(node)
+            if isinstance(node.value, ast.Name) and node.value.id == 'cpu' and node.attr == 'registers':
+                return ast.copy_location(ast.Name('registers', node.ctx), node)
+            if (isinstance(node.value, ast.Attribute) and node.value.attr == 'memory' and
+                    isinstance(node.value.value, ast.Name) and node.value.value.id == 'cpu' and
+                    node.attr in ('read', 'write')):
+                return ast.copy_location(ast.Name(node.attr, node.ctx), node)
+            return node
+
+    class Operand(ast.NodeTransformer):
+        """
+        Replace the `source()` call with an operand expression.
+        """
+        def __init__(self, value):
+            self._value = value
+
+        def visit_Call(self, node):
+            self.generic_visit(node)
+            if is_source(node):
+                return copy.deepcopy(self._value)
+            return node
+
+    def __init__(self, fn):
+        self.mnemonic = fn.__name__
+        body = ast.parse(textwrap.dedent(inspect.getsource(fn))).body[0].body
+        if isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant):
+            body = body[1:]
+        *body, last = body
+        if not (isinstance(last, ast.Return) and isinstance(last.value, ast.Tuple) and len(last.value.elts) == 2):
+            raise Exception("{0} does not end by returning (value, cycles).".format(self.mnemonic))
+
+        # Local aliases of the register file, `r = cpu.registers`
+        bindings = [statement for statement in body
+                    if isinstance(statement, ast.Assign) and isinstance(statement.targets[0], ast.Name) and
+                    ast.unparse(statement.value) == 'cpu.registers']
+        inliner = Operation.Inliner({statement.targets[0].id for statement in bindings})
+        self._body = [inliner.visit(statement) for statement in body if statement not in bindings]
+        result, extra = (inliner.visit(node) for node in last.value.elts)
+
+        self.reads = any(is_source(node) for statement in self._body for node in ast.walk(statement))
+        # Source of the value stored through the addressing mode, and of the cycles added to the base count
+        self.result = None if is_constant(result, None) else result
+        self.extra_cycles = None if is_constant(extra, 0) else ast.unparse(extra)
+        self.uses_pc = any(isinstance(node, ast.Attribute) and node.attr == 'pc' and
+                           isinstance(node.value, ast.Name) and node.value.id == 'registers'
+                           for statement in self._body for node in ast.walk(statement))
+
+    def source(self, value=None, store=None):
+        """
+        The statements of the operation, with `source()` replaced by the expression `value` and the result, if
+        any, stored through the template `store`.
+        """
+        operand = Operation.Operand(ast.parse(value, mode='eval').body if value is not None else None)
+        lines = []
+        for statement in self._body:
+            lines.extend(ast.unparse(operand.visit(copy.deepcopy(statement))).splitlines())
+        if self.result is not None:
+            lines.append(store.format(ast.unparse(operand.visit(copy.deepcopy(self.result)))))
+        if self.extra_cycles is not None:
+            lines.append("cycles += " + self.extra_cycles)
+        return lines
+
+
+def is_source(node):
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'source'
+
+
+def is_constant(node, value):
+    return isinstance(node, ast.Constant) and node.value is value
+
+
+# One Operation per instruction function, keyed by mnemonic.
+OPERATIONS = {name: Operation(fn) for name, fn in vars(instructions).items()
+              if name.isupper() and inspect.isfunction(fn)}
+
+# Operand decode from the fetched instruction bytes, by operand size.
+DECODE = {
+    0: None,
+    1: "param = mem[1]",
+    2: "param = mem[1] | (mem[2] << 8)",
+}
+
+
+def operation_source(mnemonic, mode, param=None):
+    """
+    Return the statements implementing one instruction, excluding the PC increment, the base cycles and the return.
+    The operand is decoded from `mem` unless a constant `param` is given, in which case it is inlined.
+    """
+    operation = OPERATIONS[mnemonic]
+    lines = []
+
+    if param is None:
+        decode = DECODE[mode.size]
+        if decode is not None:
+            lines.append(decode)
+        inline = lambda template: template
+    else:
+        inline = lambda template: re.sub(r'(?<![.\w])param\b', "{0:#06x}".format(param), template)
+
+    if hasattr(mode, 'address_template'):
+        if operation.reads or operation.result is not None:
+            lines.append("address = " + inline(mode.address_template))
+        value = "read(address)"
+        store = "write(address, {0})"
+    else:
+        value = getattr(mode, 'value_template', None)
+        store = getattr(mode, 'store_template', None)
+
+    if operation.reads and value is None:
+        raise Exception("{0} needs an operand, but {1} does not provide one.".format(mnemonic, mode.__name__))
+    if operation.result is not None and store is None:
+        raise Exception("{0} stores a result, but {1} cannot be written.".format(mnemonic, mode.__name__))
+
+    lines.extend(operation.source(inline(value) if value is not None else None, store))
+    return lines
+
+
+def handler_source(opcode, mnemonic, mode, base_cycles):
+    """
+    Return the source of a single handler function taking the fetched instruction bytes and returning its cycles.
+    """
+    lines = ["def op_{0:02x}(mem):".format(opcode),
+             "    # {0} {1}".format(mnemonic, mode.__name__.rsplit('.', 1)[-1]),
+             "    registers.pc = (registers.pc + {0}) & 0xffff".format(1 + mode.size)]
+    variable_cycles = OPERATIONS[mnemonic].extra_cycles is not None
+    if variable_cycles:
+        lines.append("    cycles = {0}".format(base_cycles))
+    lines.extend("    " + line for line in operation_source(mnemonic, mode))
+    lines.append("    return " + ("cycles" if variable_cycles else str(base_cycles)))
+    return "\n".join(lines)
+
+
+def handler_namespace(cpu):
+    """
+    Globals the generated code runs against.
+    """
+    return {
+        'cpu': cpu,
+        'registers': cpu.registers,
+        'read': cpu.memory.read,
+        'write': cpu.memory.write,
+    }
+
+
+def generate_handlers(cpu):
+    """
+    Compile one handler per opcode in cpu._opcodes and return them in a 256-slot dispatch list. Unknown opcodes raise.
+    """
+    namespace = handler_namespace(cpu)
+    sources = []
+    for opcode, instruction in sorted(cpu._opcodes.items()):
+        sources.append(handler_source(opcode, instruction._fn.__name__, instruction._admode, instruction._cycles))
+    exec(compile("\n\n".join(sources), "<cpu handlers>", "exec"), namespace)
+
+    def illegal(mem):
+        raise Exception("Illegal opcode {0:#04x} at {1:#06x}".format(mem[0], cpu.registers.pc))
+
+    handlers = [illegal] * 0x100
+    for opcode in cpu._opcodes:
+        handlers[opcode] = namespace["op_{0:02x}".format(opcode)]
+    return handlers
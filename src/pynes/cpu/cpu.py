@@ -2,125 +2,182 @@
 PyNES - Central Processing Unit emulation
 """
 
-import multiprocessing
-import threading
 import logging
-import numpy as np
 from cpu import instructions
 from cpu import AddressingMode
+from cpu import codegen
 
 
 log = logging.getLogger("PyNES")
 
 
-class CPU(threading.Thread):
+class CPU:
+    # Interrupt lines, as bits of CPU.pending. NMI and reset are edge triggered and clear when serviced; the IRQ
+    # sources are level triggered and stay asserted until their source releases them.
+    RESET = 0x01
+    NMI = 0x02
+    IRQ_FRAME_COUNTER = 0x04
+    IRQ_DMC = 0x08
+    IRQ_MAPPER = 0x10
+    IRQ = IRQ_FRAME_COUNTER | IRQ_DMC | IRQ_MAPPER
+
     class Memory:
+        """
+        CPU address space, decoded through a table of read and write handlers for each 256-byte page.
+        """
         def __init__(self, console):
             self._console = console
-            self._ram = [0] * 0xffff
+            self._ram = bytearray(0x800)
+            self._ram_view = memoryview(self._ram)
+            self._read_handlers = [self._read_unmapped] * 0x100
+            self._write_handlers = [self._write_unmapped] * 0x100
+
+            # RAM - $0000 - $07ff, mirrored four times up to $1fff
+            for page in range(0x00, 0x20):
+                self._read_handlers[page] = self._read_ram
+                self._write_handlers[page] = self._write_ram
+
+            # PPU registers - $2000 - $2007, mirrored every 8 bytes up to $3fff
+            for page in range(0x20, 0x40):
+                self._read_handlers[page] = self._read_ppu
+                self._write_handlers[page] = self._write_ppu
+
+            # pAPU, DMA and controller registers
+            self._read_handlers[0x40] = self._read_io
+            self._write_handlers[0x40] = self._write_io
+
+            # Save RAM
+            for page in range(0x60, 0x80):
+                self._read_handlers[page] = self._read_save_ram
+                self._write_handlers[page] = self._write_save_ram
+
+            # PRG ROM - writes go to the mapper, reads are rebuilt on bank switches
+            for page in range(0x80, 0x100):
+                self._write_handlers[page] = console.Cart.mem_write
+            self.map_prg(0x8000, 0x10000)
+            console.Cart.mapper.add_prg_listener(self.map_prg)
 
         def write(self, address, value):
-            # log.debug("Memory write to address {0:#4x}".format(address))
-            if address < 0 or address > 0xffff:
-                raise Exception("Memory write out of bounds: {0x:#06x}".format(address))
-
-            # RAM - Mirrored four times, so get the base address before writing.
-            if address < 0x2000:
-                base_address = address % 0x800
-                self._ram[base_address] = np.uint8(value)
-
-            elif 0x2000 <= address < 0x4000:
-                 # PPU Registers
-                base = (address - 0x2000) % 8
-                if base == 0:
-                    self._console.PPU.update_control_1(value)
-                elif base == 1:
-                    self._console.PPU.update_control_2(value)
-                elif base == 3:
-                    self._console.PPU.spr_ram_addr = value
-                elif base == 4:
-                    self._console.PPU.write_sprram(value)
-                elif base in (5, 6, 7):
-                    self._console.PPU.reg_write(base + 0x2000, value)
-                else:
-                    log.debug("Unhandled I/O register write: {0:#06x}".format(address))
-
-            elif 0x4000 <= address < 0x4014 or address == 0x4015:
-                # pAPU registers
-                log.debug("Unhandled write to pAPU registers")
-
-            elif address == 0x4014:
-                # DMA Sprite Transfer
-                srcaddr = value * 0x100
-                if 0x8000 <= srcaddr < 0x10000:
-                    self._console.PPU.dma_sprram(self._console.Cart.prg_rom[srcaddr:srcaddr + 0x100])
-                    self._console.CPU.Cycles += 512
-                else:
-                    log.critical("DMA Sprite Transfer from source other than PRGROM ({0:#06x})".format(srcaddr))
-                    raise Exception()
-
-            elif address == 0x4016 or address == 0x4017:
-                log.debug("Unhandled write to controller registers")
-                # Controller registers
-
-            elif 0x6000 <= address < 0x8000:
-                log.debug("Unhandled write to Save RAM")
-                # Save RAM
-
-            elif 0x8000 <= address < 0x10000:
-                self._console.Cart.mem_write(address, value)
+            self._write_handlers[address >> 8](address, value)
 
+        def read(self, address):
+            return self._read_handlers[address >> 8](address)
+
+        def read_page(self, page):
+            """
+            The 256 bytes at page << 8, as sprite DMA sees them. RAM and PRG ROM pages are sliced without copying,
+            anything else is read a byte at a time through the handlers.
+            """
+            start = page << 8
+            if page < 0x20:
+                start &= 0x7ff
+                return self._ram_view[start:start + 0x100]
+            elif page >= 0x80:
+                start &= 0x3fff
+                return self._console.Cart.prg_banks[(page >> 6) & 1][start:start + 0x100]
+            return bytes((self.read(address) or 0) for address in range(start, start + 0x100))
+
+        def map_prg(self, start, end):
+            """
+            Rebuild the read handlers for the PRG ROM pages in [start, end)
+            """
+            banks = self._console.Cart.prg_banks
+            for page in range(start >> 8, end >> 8):
+                self._read_handlers[page] = lambda address, bank=banks[(page >> 6) & 1]: bank[address & 0x3fff]
+
+        def _read_ram(self, address):
+            return self._ram[address & 0x7ff]
+
+        def _write_ram(self, address, value):
+            self._ram[address & 0x7ff] = value
+
+        def _read_ppu(self, address):
+            base = address & 0x7
+            if base == 2:
+                return self._console.PPU.status_register()
+            elif base == 4:
+                return self._console.PPU.read_sprram()
             else:
-                raise Exception("Unhandled memory write to address {0:#06x}".format(address))
+                log.debug("Unhandled I/O register read: {0:#06x} (pc: {1:#06x})".format(address, self._console.CPU.registers.pc))
 
-        def read(self, address):
-            # log.debug("Memory read from address {0:#4x}".format(address))
-            if address < 0 or address > 0xffff:
-                raise Exception("Memory read out of bounds: {0:#06x}".format(address))
-
-            if address < 0x2000:
-                # RAM
-                base_address = address % 0x800
-                return np.uint8(self._ram[base_address])
-
-            elif 0x2000 <= address < 0x4000:
-                # PPU Registers
-                base = (address - 0x2000) % 8
-                if base == 2:
-                    return self._console.PPU.status_register()
-                elif base == 4:
-                    return self._console.PPU.read_sprram()
-                else:
-                    log.debug("Unhandled I/O register read: {0:#06x} (pc: {1:#06x})".format(address, self._console.CPU.registers['pc'].read()))
-
-            elif 0x6000 <= address < 0x8000:
-                log.debug("Unhandled read from Save RAM")
-
-            elif 0x8000 <= address < 0x10000:
-                return self._console.Cart.prg_rom[address - 0x8000]
+        def _write_ppu(self, address, value):
+            self._console.PPU.write_register(address & 0x7, value)
 
-            else:
-                raise Exception("Unhandled memory read at {0:#06x}".format(address))
+        def _read_io(self, address):
+            if address == 0x4015:
+                return self._console.APU.read_status()
+            log.debug("Unhandled read from controller register {0:#06x}".format(address))
+            return 0
 
-    class Register:
-        def __init__(self, dtype):
-            self._dtype = dtype
-            self._value = 0xff
+        def _write_io(self, address, value):
+            if address < 0x4014 or address == 0x4015 or address == 0x4017:
+                # pAPU registers, including the frame counter at $4017
+                self._console.APU.register_write(address, value)
 
-        def write(self, value):
-            self._value = self._dtype(value)
+            elif address == 0x4014:
+                # DMA Sprite Transfer: the CPU is halted for 513 cycles, plus one to align when it starts on an
+                # odd cycle.
+                self._console.PPU.dma_sprram(self.read_page(value))
+                self._console.CPU.stall += 513 + (self._console.scheduler.clock & 1)
 
-        def read(self):
-            return self._dtype(self._value)
+            elif address == 0x4016:
+                log.debug("Unhandled write to controller registers")
+                # Controller registers
 
-        def set_bit(self, bitnum, isset):
-            if isset:
-                self._value |= (1 << bitnum)
             else:
-                self._value &= ~(1 << bitnum)
-
-        def increment(self, value=1):
-            self._value = self._dtype(value + self._value)
+                self._write_unmapped(address, value)
+
+        def _read_save_ram(self, address):
+            log.debug("Unhandled read from Save RAM")
+
+        def _write_save_ram(self, address, value):
+            log.debug("Unhandled write to Save RAM")
+
+        def _read_unmapped(self, address):
+            raise Exception("Unhandled memory read at {0:#06x}".format(address))
+
+        def _write_unmapped(self, address, value):
+            raise Exception("Unhandled memory write to address {0:#06x}".format(address))
+
+    class Registers:
+        """
+        Register file holding plain ints. The status flags are separate fields and are only packed into a P byte
+        when it is pushed or pulled.
+
+        N and Z are evaluated lazily: instructions store their result in `nz`, Z is set when its low byte is zero and
+        N when bit 7 or bit 8 is set. Bit 8 lets BIT and PLP describe a negative, zero result.
+        """
+        __slots__ = ('pc', 'a', 'x', 'y', 'sp', 'carry', 'interrupt', 'decimal', 'overflow', 'nz')
+
+        def __init__(self):
+            self.pc = 0xff
+            self.a = 0xff
+            self.x = 0xff
+            self.y = 0xff
+            self.sp = 0xff
+            self.unpack_status(0b00100000)
+
+        @property
+        def zero(self):
+            return not self.nz & 0xff
+
+        @property
+        def negative(self):
+            return bool(self.nz & 0x180)
+
+        def pack_status(self, brk=False):
+            """
+            Build the P byte. Bit 5 is always set, and bit 4 (break) only exists on the stack copy.
+            """
+            return (self.carry | (self.zero << 1) | (self.interrupt << 2) | (self.decimal << 3) | (brk << 4) |
+                    0x20 | (self.overflow << 6) | (self.negative << 7))
+
+        def unpack_status(self, value):
+            self.carry = bool(value & 0x01)
+            self.interrupt = bool(value & 0x04)
+            self.decimal = bool(value & 0x08)
+            self.overflow = bool(value & 0x40)
+            self.nz = (not value & 0x02) | ((value & 0x80) << 1)
 
     class Instruction:
         def __init__(self, cpu, fn, addressing, base_cycles):
@@ -134,8 +191,8 @@ class CPU(threading.Thread):
             for i in range(self._admode.size):
                 param += mem[i] << (8 * i)
             source = lambda: self._admode.read(self._cpu, param)
-            # log.debug("{2:#06x}: {0} {1} (cycles: {3})".format(self._fn.__name__, self._admode.print(param), self._cpu.registers['pc'].read(), self._cpu.Cycles.value))
-            self._cpu.registers['pc'].increment(value=1 + self._admode.size)
+            # log.debug("{2:#06x}: {0} {1} (cycles: {3})".format(self._fn.__name__, self._admode.print(param), self._cpu.registers.pc, self._cpu._console.scheduler.clock))
+            self._cpu.registers.pc = (self._cpu.registers.pc + 1 + self._admode.size) & 0xffff
             fn_value, fncycles = self._fn(self._cpu, source)
             if fn_value is not None:
                 self._admode.write(self._cpu, param, fn_value)
@@ -145,24 +202,12 @@ class CPU(threading.Thread):
     def __init__(self, console):
         self._console = console
         self.memory = CPU.Memory(console)
-        self.registers = {'pc': CPU.Register(np.uint16), 'a': CPU.Register(np.int8), 'x': CPU.Register(np.uint8),
-                          'y': CPU.Register(np.uint8), 'sp': CPU.Register(np.uint8), 'p': CPU.Register(np.uint8)}
-        self.registers['p'].write(0b00100000)
-        self._status_bits = {
-            "carry": 0,
-            "zero": 1,
-            "interrupt": 2,
-            "decimal": 3,
-            "break": 4,
-            "overflow": 6,
-            "negative": 7,
-        }
+        self.registers = CPU.Registers()
 
         self._cart = console.Cart
-        self.EndOfCycle = threading.Event()
-        self.Cycles = multiprocessing.Value("I", 0)
-        self.IRQ = multiprocessing.Value("c")
-        self.IRQ.value = b'R'  # Set reset IRQ
+        # Cycles the CPU is halted for (e.g. by sprite DMA), charged to the next step.
+        self.stall = 0
+        self.pending = CPU.RESET
 
         self._opcodes = {
             0x00: CPU.Instruction(self, instructions.BRK, AddressingMode.NONE, 7),
@@ -325,70 +370,104 @@ class CPU(threading.Thread):
             0xfe: CPU.Instruction(self, instructions.INC, AddressingMode.ABSOLUTE_X, 7)
         }
 
-        super(CPU, self).__init__()
-
-    def set_status(self, status, value):
-        if status == "zero":
-            self.registers['p'].set_bit(1, value == 0)
-        elif status == "negative":
-            self.registers['p'].set_bit(7, value & (1 << 7))
-        else:
-            self.registers['p'].set_bit(self._status_bits[status], value)
+        # Flat per-opcode handlers generated from the table above. Set `interpreter` to `execute` to run
+        # through the Instruction objects instead.
+        self._handlers = codegen.generate_handlers(self)
+        self.interpreter = self.dispatch
 
-    def get_status(self, status):
-        bitnum = self._status_bits[status]
-        return bool(self.registers['p'].read() & (1 << bitnum))
+        # Set to a blocks.BlockCache to run PRG ROM code as translated basic blocks.
+        self.blocks = None
 
     def execute(self, mem):
         code = mem[0]
         try:
             return self._opcodes[code](mem[1:3])
         except:
-            log.critical("Exception while executing: {0:#06x}: {1}".format(self.registers['pc'].read(), ["{0:#04x}".format(x) for x in mem]))
-            for register_name in self.registers:
-                log.critical("{0}: {1:#06x}".format(register_name, self.registers[register_name].read()))
+            log.critical("Exception while executing: {0:#06x}: {1}".format(self.registers.pc, ["{0:#04x}".format(x) for x in mem]))
+            for register_name in ('pc', 'a', 'x', 'y', 'sp'):
+                log.critical("{0}: {1:#06x}".format(register_name, getattr(self.registers, register_name)))
+            log.critical("p: {0:#06x}".format(self.registers.pack_status()))
             raise
 
+    def fetch(self, pc):
+        """
+        Return the opcode at pc and the two bytes after it.
+        """
+        if pc >= 0x8000:
+            # Go directly to the cartridge PRG bank to read multiple bytes, unless they straddle two banks.
+            offset = pc & 0x3fff
+            if offset < 0x3ffe:
+                return self._cart.prg_banks[(pc >> 14) & 1][offset:offset + 3]
+        return [self.memory.read((pc + i) & 0xffff) for i in range(3)]
+
+    def dispatch(self, mem):
+        return self._handlers[mem[0]](mem)
+
     def stack_push(self, value):
-        self.registers['sp'].increment(value=-1)
-        self.memory.write(0x100 + self.registers['sp'].read(), value)
+        sp = (self.registers.sp - 1) & 0xff
+        self.registers.sp = sp
+        self.memory.write(0x100 + sp, value)
 
     def stack_pop(self):
-        val = self.memory.read(0x100 + self.registers['sp'].read())
-        self.registers['sp'].increment()
+        val = self.memory.read(0x100 + self.registers.sp)
+        self.registers.sp = (self.registers.sp + 1) & 0xff
         return val
 
-    def run(self):
-        while True:
-            # Check IRQs
-            if self.IRQ.value != b'\x00':
-                log.debug("IRQ triggered with code {0}.".format(self.IRQ.value))
-                self.stack_push((self.registers['pc'].read() << 8) & 0xff)
-                self.stack_push((self.registers['pc'].read()) & 0xff)
-                self.stack_push(self.registers['p'].read())
-                self.set_status('interrupt', True)
-
-                if self.IRQ.value == b'N':  # NMI
-                    self.registers['pc'].write(self.memory.read(0xfffb) << 8 | self.memory.read(0xfffa))
-                elif self.IRQ.value == b'R':  # Reset
-                    self.registers['pc'].write((self.memory.read(0xfffd) << 8) | self.memory.read(0xfffc))
-                elif self.IRQ.value == b'I' and not self.get_status('interrupt'):  # Maskable Interrupt
-                    self.registers['pc'].write((self.memory.read(0xffff) << 8) | self.memory.read(0xfffe))
-
-                # Clear the IRQ
-                self.IRQ.value = 0
-
-            # Fetch the next instruction, execute it, update PC and cycle counter.
-            pc = self.registers['pc'].read()
-            # Go directly to the cartridge prg_rom to read multiple bytes.
-            pc -= 0x8000
-            increment_cycles = self.execute(self._cart.prg_rom[pc:pc+3])
-            self.Cycles.value += increment_cycles
-            # Check for start of VBLANK
-            if self.Cycles.value >= 27426 and not self._console.PPU.vblank:
-                self._console.PPU.enter_vblank()
-            # End of VBLANK
-            if self.Cycles.value >= 29692:
-                self._console.PPU.exit_vblank()
-                self.Cycles.value = 0
-                self.EndOfCycle.set()
+    def assert_interrupt(self, line):
+        self.pending |= line
+
+    def release_interrupt(self, line):
+        self.pending &= ~line
+
+    def service_interrupt(self):
+        """
+        Take the highest priority pending interrupt, if it is not masked. Returns the cycles it took.
+        """
+        registers = self.registers
+        if self.pending & CPU.RESET:
+            log.debug("Reset")
+            self.pending &= ~(CPU.RESET | CPU.NMI)
+            # Reset runs the interrupt sequence with writes suppressed.
+            registers.sp = (registers.sp - 3) & 0xff
+            registers.interrupt = True
+            registers.pc = self.memory.read(0xfffc) | (self.memory.read(0xfffd) << 8)
+            return 7
+
+        if self.pending & CPU.NMI:
+            log.debug("NMI")
+            self.pending &= ~CPU.NMI
+            vector = 0xfffa
+        elif not registers.interrupt:
+            log.debug("IRQ (lines {0:#04x})".format(self.pending))
+            vector = 0xfffe
+        else:
+            return 0
+
+        self.stack_push(registers.pc >> 8)
+        self.stack_push(registers.pc & 0xff)
+        self.stack_push(registers.pack_status())
+        registers.interrupt = True
+        registers.pc = self.memory.read(vector) | (self.memory.read(vector + 1) << 8)
+        return 7
+
+    def step(self):
+        """
+        Service a pending interrupt, then fetch and execute one instruction. Returns the cycles it took.
+        """
+        cycles = 0
+        # An IRQ line can stay asserted for a long time while IRQs are masked, so only call out when it can be taken.
+        pending = self.pending
+        if pending and (pending & ~CPU.IRQ or not self.registers.interrupt):
+            cycles = self.service_interrupt()
+
+        # Fetch the next instruction (or translated block) and execute it.
+        pc = self.registers.pc
+        if self.blocks is not None and pc >= 0x8000:
+            scheduler = self._console.scheduler
+            cycles += self.blocks.run(pc, scheduler.boundary - scheduler.clock - cycles)
+        else:
+            cycles += self.interpreter(self.fetch(pc))
+        if self.stall:
+            cycles += self.stall
+            self.stall = 0
+        return cycles
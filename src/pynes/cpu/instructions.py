@@ -4,29 +4,22 @@ __author__ = 'misha'
 
 log = logging.getLogger("PyNES")
 
+# The generated handlers are inlined from these bodies, so the conditional branches test N and Z straight from
+# registers.nz, as its `negative` and `zero` properties do, rather than through the properties.
+
 
 def ADC(cpu, source):
     """
     Add value to A with carry
     """
+    r = cpu.registers
     value = source()
-    carry = int(cpu.get_status('carry'))
-    total = value + cpu.registers['a'].read() + carry
-    cpu.set_status('zero', total & 0xff)
-    if cpu.get_status('decimal'):
-        if (cpu.registers['a'].read() & 0xf) + (value & 0xf) + carry > 9:
-            total += 6
-        if total > 0x99:
-            total += 96
-        cpu.set_status('carry', total > 0x99)
-    else:
-        cpu.set_status('carry', total > 0xff)
-
-    cpu.registers['a'].write(total)
-    cpu.set_status('zero', total)
-    cpu.set_status('negative', total)
-    cpu.set_status('overflow', (total != cpu.registers['a'].read()))
-
+    total = r.a + value + r.carry
+    # The 2A03 has no decimal mode, so the decimal flag is ignored.
+    r.carry = total > 0xff
+    r.overflow = (~(r.a ^ value) & (r.a ^ total) & 0x80) != 0
+    r.a = total & 0xff
+    r.nz = r.a
     return None, 0
 
 
@@ -34,11 +27,9 @@ def AND(cpu, source):
     """
     'AND' memory with Accumulator
     """
-    value = source()
-    value &= cpu.registers['a'].read()
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
-    cpu.registers['a'].write(value)
+    r = cpu.registers
+    r.a &= source()
+    r.nz = r.a
     return None, 0
 
 
@@ -46,11 +37,11 @@ def ASL(cpu, source):
     """
     Shift left one bit
     """
+    r = cpu.registers
     value = source()
-    cpu.set_status('carry', bool(value & 0x80))
+    r.carry = value >= 0x80
     value = (value << 1) & 0xff
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
+    r.nz = value
     return value, 0
 
 
@@ -58,15 +49,16 @@ def BCC(cpu, source):
     """
     Branch if carry flag is *not* set
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('carry') is not True:
+    if not r.carry:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -74,15 +66,16 @@ def BCS(cpu, source):
     """
     Branch if carry flag is set
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('carry') is True:
+    if r.carry:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -90,15 +83,16 @@ def BEQ(cpu, source):
     """
     Branch if result was zero
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('zero') is True:
+    if not r.nz & 0xff:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -106,10 +100,11 @@ def BIT(cpu, source):
     """
     Compare bits
     """
+    r = cpu.registers
     value = source()
-    cpu.set_status('negative', value)
-    cpu.set_status('overflow', value & 0x40)
-    cpu.set_status('zero', value & cpu.registers['a'].read())
+    r.overflow = (value & 0x40) != 0
+    # N comes from bit 7 of the operand, Z from the AND with the accumulator
+    r.nz = (value & r.a) | ((value & 0x80) << 1)
     return None, 0
 
 
@@ -117,15 +112,16 @@ def BMI(cpu, source):
     """
     Branch if result was negative
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('negative') is True:
+    if r.nz & 0x180:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -133,15 +129,16 @@ def BNE(cpu, source):
     """
     Branch if result was *not* zero
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('zero') is False:
+    if r.nz & 0xff:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -149,15 +146,16 @@ def BPL(cpu, source):
     """
     Branch if result was positive
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('negative') is False:
+    if not r.nz & 0x180:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -165,23 +163,31 @@ def BRK(cpu, *args):
     """
     Request a maskable interrupt (IRQ)
     """
-    cpu.set_status('break', True)
-    cpu.IRQ.value = "I"
+    r = cpu.registers
+    # BRK skips the padding byte after the opcode
+    pc = (r.pc + 1) & 0xffff
+    cpu.stack_push(pc >> 8)
+    cpu.stack_push(pc & 0xff)
+    cpu.stack_push(r.pack_status(True))
+    r.interrupt = True
+    r.pc = cpu.memory.read(0xfffe) | (cpu.memory.read(0xffff) << 8)
+    return None, 0
 
 
 def BVC(cpu, source):
     """
     Branch if overflow flag is *not* set
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('overflow') is False:
+    if not r.overflow:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -189,15 +195,16 @@ def BVS(cpu, source):
     """
     Branch if overflow flag is set
     """
+    r = cpu.registers
     offset = source()
     extra_cycle = 0
-    if cpu.get_status('overflow') is True:
+    if r.overflow:
         extra_cycle = 1
-        pc = cpu.registers['pc'].read()
+        target = (r.pc + offset) & 0xffff
         # Add an extra cycle if going across pages
-        if (pc * 0xff00) != (pc + offset & 0xff00):
+        if (r.pc & 0xff00) != (target & 0xff00):
             extra_cycle += 1
-        cpu.registers['pc'].increment(value=offset)
+        r.pc = target
     return None, extra_cycle
 
 
@@ -205,7 +212,7 @@ def CLC(cpu, *args):
     """
     Clear carry status flag
     """
-    cpu.set_status('carry', False)
+    cpu.registers.carry = False
     return None, 0
 
 
@@ -213,7 +220,7 @@ def CLD(cpu, *args):
     """
     Clear decimal status flag
     """
-    cpu.set_status('decimal', False)
+    cpu.registers.decimal = False
     return None, 0
 
 
@@ -221,7 +228,7 @@ def CLI(cpu, *args):
     """
     Clear interrupt status flag
     """
-    cpu.set_status('interrupt', False)
+    cpu.registers.interrupt = False
     return None, 0
 
 
@@ -229,7 +236,7 @@ def CLV(cpu, *args):
     """
     Clear overflow status flag
     """
-    cpu.set_status('overflow', False)
+    cpu.registers.overflow = False
     return None, 0
 
 
@@ -237,10 +244,11 @@ def CMP(cpu, source):
     """
     Compare accumulator with value
     """
-    comp = cpu.registers['a'].read() - source()
-    cpu.set_status('carry', (comp < 0x100))
-    cpu.set_status('negative', comp)
-    cpu.set_status('zero', comp & 0xff)
+    r = cpu.registers
+    comp = r.a - source()
+    r.carry = comp >= 0
+    comp &= 0xff
+    r.nz = comp
     return None, 0
 
 
@@ -248,10 +256,11 @@ def CPX(cpu, source):
     """
     Compare X-register with value
     """
-    comp = cpu.registers['x'].read() - source()
-    cpu.set_status('carry', (comp < 0x100))
-    cpu.set_status('negative', comp)
-    cpu.set_status('zero', comp & 0xff)
+    r = cpu.registers
+    comp = r.x - source()
+    r.carry = comp >= 0
+    comp &= 0xff
+    r.nz = comp
     return None, 0
 
 
@@ -259,10 +268,11 @@ def CPY(cpu, source):
     """
     Compare Y-register with value
     """
-    comp = cpu.registers['y'].read() - source()
-    cpu.set_status('carry', (comp < 0x100))
-    cpu.set_status('negative', comp)
-    cpu.set_status('zero', comp & 0xff)
+    r = cpu.registers
+    comp = r.y - source()
+    r.carry = comp >= 0
+    comp &= 0xff
+    r.nz = comp
     return None, 0
 
 
@@ -270,9 +280,9 @@ def DEC(cpu, source):
     """
     Decrement memory
     """
+    r = cpu.registers
     value = (source() - 1) & 0xff
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
+    r.nz = value
     return value, 0
 
 
@@ -280,10 +290,9 @@ def DEX(cpu, *args):
     """
     Decrement X-register
     """
-    x = cpu.registers['x'].read()
-    cpu.registers['x'].write(x - 1)
-    cpu.set_status('negative', x)
-    cpu.set_status('zero', x)
+    r = cpu.registers
+    r.x = (r.x - 1) & 0xff
+    r.nz = r.x
     return None, 0
 
 
@@ -291,10 +300,9 @@ def DEY(cpu, *args):
     """
     Decrement Y-register
     """
-    y = cpu.registers['y'].read()
-    cpu.registers['y'].write(y - 1)
-    cpu.set_status('negative', y)
-    cpu.set_status('zero', y)
+    r = cpu.registers
+    r.y = (r.y - 1) & 0xff
+    r.nz = r.y
     return None, 0
 
 
@@ -302,10 +310,9 @@ def EOR(cpu, source):
     """
     XOR value with accumulator
     """
-    value = source() ^ cpu.registers['a'].read()
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
-    cpu.registers['a'].write(value)
+    r = cpu.registers
+    r.a ^= source()
+    r.nz = r.a
     return None, 0
 
 
@@ -313,9 +320,9 @@ def INC(cpu, source):
     """
     Increment memory
     """
+    r = cpu.registers
     value = (source() + 1) & 0xff
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
+    r.nz = value
     return value, 0
 
 
@@ -323,11 +330,9 @@ def INX(cpu, *args):
     """
     Increment X-register
     """
-    x = cpu.registers['x'].read()
-    x = (x + 1) & 0xff
-    cpu.registers['x'].write(x)
-    cpu.set_status('negative', x)
-    cpu.set_status('zero', x)
+    r = cpu.registers
+    r.x = (r.x + 1) & 0xff
+    r.nz = r.x
     return None, 0
 
 
@@ -335,11 +340,9 @@ def INY(cpu, *args):
     """
     Increment Y-register
     """
-    y = cpu.registers['y'].read()
-    y = (y + 1) & 0xff
-    cpu.registers['y'].write(y)
-    cpu.set_status('negative', y)
-    cpu.set_status('zero', y)
+    r = cpu.registers
+    r.y = (r.y + 1) & 0xff
+    r.nz = r.y
     return None, 0
 
 
@@ -347,7 +350,7 @@ def JMP(cpu, source):
     """
     Jump to a location in memory
     """
-    cpu.registers['pc'].write(source())
+    cpu.registers.pc = source()
     return None, 0
 
 
@@ -355,10 +358,10 @@ def JSR(cpu, source):
     """
     Jump to a location in memory and store the return address on the stack
     """
-    pc = cpu.registers['pc'].read()
-    cpu.stack_push((pc >> 8) & 0xff)
-    cpu.stack_push(pc & 0xff)
-    cpu.registers['pc'].write(source())
+    r = cpu.registers
+    cpu.stack_push(r.pc >> 8)
+    cpu.stack_push(r.pc & 0xff)
+    r.pc = source()
     return None, 0
 
 
@@ -366,10 +369,9 @@ def LDA(cpu, source):
     """
     Load a value into the accumulator
     """
-    value = source()
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
-    cpu.registers['a'].write(value)
+    r = cpu.registers
+    r.a = source()
+    r.nz = r.a
     return None, 0
 
 
@@ -377,10 +379,9 @@ def LDX(cpu, source):
     """
     Load a value into the X-register
     """
-    value = source()
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
-    cpu.registers['x'].write(value)
+    r = cpu.registers
+    r.x = source()
+    r.nz = r.x
     return None, 0
 
 
@@ -388,10 +389,9 @@ def LDY(cpu, source):
     """
     Load a value into the Y-register
     """
-    value = source()
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
-    cpu.registers['y'].write(value)
+    r = cpu.registers
+    r.y = source()
+    r.nz = r.y
     return None, 0
 
 
@@ -399,11 +399,11 @@ def LSR(cpu, source):
     """
     Shift right one bit
     """
+    r = cpu.registers
     value = source()
-    cpu.set_status('carry', bool(value & 0x01))
+    r.carry = (value & 0x01) != 0
     value >>= 1
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
+    r.nz = value
     return value, 0
 
 
@@ -418,10 +418,9 @@ def ORA(cpu, source):
     """
     'OR' memory with Accumulator
     """
-    value = source() | cpu.registers['a'].read()
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
-    cpu.registers['a'].write(value)
+    r = cpu.registers
+    r.a |= source()
+    r.nz = r.a
     return None, 0
 
 
@@ -429,7 +428,7 @@ def PHA(cpu, *args):
     """
     Push the accumulator onto the stack
     """
-    cpu.stack_push(cpu.registers['a'].read())
+    cpu.stack_push(cpu.registers.a)
     return None, 0
 
 
@@ -437,7 +436,7 @@ def PHP(cpu, *args):
     """
     Push the status register onto the stack
     """
-    cpu.stack_push(cpu.registers['p'].read())
+    cpu.stack_push(cpu.registers.pack_status(True))
     return None, 0
 
 
@@ -445,10 +444,9 @@ def PLA(cpu, *args):
     """
     Pop the accumulator from the stack
     """
-    a = cpu.stack_pop()
-    cpu.set_status('negative', a)
-    cpu.set_status('zero', a)
-    cpu.registers['a'].write(a)
+    r = cpu.registers
+    r.a = cpu.stack_pop()
+    r.nz = r.a
     return None, 0
 
 
@@ -456,7 +454,7 @@ def PLP(cpu, *args):
     """
     Pop the status register from the stack
     """
-    cpu.registers['p'].write(cpu.stack_pop())
+    cpu.registers.unpack_status(cpu.stack_pop())
     return None, 0
 
 
@@ -464,13 +462,12 @@ def ROL(cpu, source):
     """
     Rotate value one bit left
     """
-    value = source() << 1
-    if cpu.get_status('carry') is True:
-        value |= 0x1
-    cpu.set_status('carry', value > 0xff)
-    value &= 0xff
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
+    r = cpu.registers
+    value = source()
+    carry = r.carry
+    r.carry = value >= 0x80
+    value = ((value << 1) & 0xff) | carry
+    r.nz = value
     return value, 0
 
 
@@ -478,13 +475,12 @@ def ROR(cpu, source):
     """
     Rotate value one bit right
     """
+    r = cpu.registers
     value = source()
-    if cpu.get_status('carry') is True:
-        value |= 0x1
-    cpu.set_status('carry', bool(value & 0x01))
-    value >>= 1
-    cpu.set_status('negative', value)
-    cpu.set_status('zero', value)
+    carry = r.carry
+    r.carry = (value & 0x01) != 0
+    value = (value >> 1) | (carry << 7)
+    r.nz = value
     return value, 0
 
 
@@ -492,10 +488,11 @@ def RTI(cpu, *args):
     """
     Return from interrupt
     """
-    cpu.registers['p'].write(cpu.stack_pop())
+    r = cpu.registers
+    r.unpack_status(cpu.stack_pop())
     pc = cpu.stack_pop()
-    pc += (cpu.stack_pop() << 8)
-    cpu.registers['pc'].write(pc)
+    pc |= (cpu.stack_pop() << 8)
+    r.pc = pc
     return None, 0
 
 
@@ -504,8 +501,8 @@ def RTS(cpu, *args):
     Return from subroutine
     """
     pc = cpu.stack_pop()
-    pc += (cpu.stack_pop() << 8)
-    cpu.registers['pc'].write(pc)
+    pc |= (cpu.stack_pop() << 8)
+    cpu.registers.pc = pc
     return None, 0
 
 
@@ -513,20 +510,14 @@ def SBC(cpu, source):
     """
     Subtract with carry
     """
+    r = cpu.registers
     value = source()
-    carry = int(not cpu.get_status('carry'))
-    a = cpu.registers['a'].read()
-    diff = a - value - carry
-    cpu.set_status('negative', diff)
-    cpu.set_status('zero', (diff & 0xff))
-    cpu.set_status('overflow', ((a ^ diff) & 0x80) and ((a ^ value) & 0x80))
-    if cpu.get_status('decimal') is True:
-        if ((a & 0xf) - carry) < (value & 0xf):
-            diff -= 6
-        if diff > 0x99:
-            diff -= 0x60
-    cpu.set_status('carry', diff < 0x100)
-    cpu.registers['a'].write(diff & 0xff)
+    diff = r.a - value - (not r.carry)
+    # The 2A03 has no decimal mode, so the decimal flag is ignored.
+    r.carry = diff >= 0
+    r.overflow = ((r.a ^ value) & (r.a ^ diff) & 0x80) != 0
+    r.a = diff & 0xff
+    r.nz = r.a
     return None, 0
 
 
@@ -534,7 +525,7 @@ def SEC(cpu, *args):
     """
     Set carry status flag
     """
-    cpu.set_status('carry', True)
+    cpu.registers.carry = True
     return None, 0
 
 
@@ -542,7 +533,7 @@ def SED(cpu, *args):
     """
     Set decimal status flag
     """
-    cpu.set_status('decimal', True)
+    cpu.registers.decimal = True
     return None, 0
 
 
@@ -550,7 +541,7 @@ def SEI(cpu, *args):
     """
     Set interrupt ignore status flag
     """
-    cpu.set_status('interrupt', True)
+    cpu.registers.interrupt = True
     return None, 0
 
 
@@ -558,31 +549,30 @@ def STA(cpu, *args):
     """
     Store accumulator value in memory location
     """
-    return cpu.registers['a'].read(), 0
+    return cpu.registers.a, 0
 
 
 def STX(cpu, *args):
     """
     Store X-register value in memory
     """
-    return cpu.registers['x'].read(), 0
+    return cpu.registers.x, 0
 
 
 def STY(cpu, *args):
     """
     Store Y-register value in memory
     """
-    return cpu.registers['y'].read(), 0
+    return cpu.registers.y, 0
 
 
 def TAX(cpu, *args):
     """
     Transfer accumulator to X-register
     """
-    a = cpu.registers['a'].read()
-    cpu.set_status('negative', a)
-    cpu.set_status('zero', a)
-    cpu.registers['x'].write(a)
+    r = cpu.registers
+    r.x = r.a
+    r.nz = r.x
     return None, 0
 
 
@@ -590,10 +580,9 @@ def TAY(cpu, *args):
     """
     Transfer accumulator to Y-register
     """
-    a = cpu.registers['a'].read()
-    cpu.set_status('negative', a)
-    cpu.set_status('zero', a)
-    cpu.registers['y'].write(a)
+    r = cpu.registers
+    r.y = r.a
+    r.nz = r.y
     return None, 0
 
 
@@ -601,10 +590,9 @@ def TSX(cpu, *args):
     """
     Transfer stack pointer to X-register
     """
-    sp = cpu.registers['sp'].read()
-    cpu.set_status('negative', sp)
-    cpu.set_status('zero', sp)
-    cpu.registers['x'].write(sp)
+    r = cpu.registers
+    r.x = r.sp
+    r.nz = r.x
     return None, 0
 
 
@@ -612,10 +600,9 @@ def TXA(cpu, *args):
     """
     Transfer X-register to accumulator
     """
-    x = cpu.registers['x'].read()
-    cpu.set_status('negative', x)
-    cpu.set_status('zero', x)
-    cpu.registers['a'].write(x)
+    r = cpu.registers
+    r.a = r.x
+    r.nz = r.a
     return None, 0
 
 
@@ -623,7 +610,8 @@ def TXS(cpu, *args):
     """
     Transfer X-register to stack pointer
     """
-    cpu.registers['sp'].write(cpu.registers['x'].read())
+    r = cpu.registers
+    r.sp = r.x
     return None, 0
 
 
@@ -631,8 +619,7 @@ def TYA(cpu, *args):
     """
     Transfer Y-register to accumulator
     """
-    y = cpu.registers['y'].read()
-    cpu.set_status('negative', y)
-    cpu.set_status('zero', y)
-    cpu.registers['a'].write(y)
+    r = cpu.registers
+    r.a = r.y
+    r.nz = r.a
     return None, 0
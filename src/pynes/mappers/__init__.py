@@ -1,4 +1,7 @@
 from mappers.mapper import *
+from mappers.nrom import *
 from mappers.mmc1 import *
+from mappers.uxrom import *
+from mappers.cnrom import *
 
-__all__ = ['Mapper', 'MMC1']
+__all__ = ['MAPPERS', 'Mapper', 'register', 'NROM', 'MMC1', 'UxROM', 'CNROM']
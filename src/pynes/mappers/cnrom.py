@@ -0,0 +1,12 @@
+from mappers.mapper import Mapper, register
+
+
+@register(3)
+class CNROM(Mapper):
+    """
+    Fixed PRG ROM as on NROM, and a switchable 8KB CHR ROM bank.
+    """
+    def mem_write(self, address, value):
+        # The board does not decode writes away from the ROM, so the value is ANDed with the byte at the address.
+        value &= self.prg_banks[(address >> 14) & 1][address & 0x3fff]
+        self.switch_chr(0x0000, value)
@@ -1,9 +1,104 @@
+# Mapper classes by iNES mapper ID, filled in by @register
+MAPPERS = {}
+
+
+def register(mapper_id):
+  """
+  Class decorator adding a Mapper to MAPPERS under its iNES mapper ID
+  """
+  def add(cls):
+    MAPPERS[mapper_id] = cls
+    return cls
+  return add
+
+
 class Mapper(object):
+  """
+  Base for cartridge boards. A mapper's state is its bank tables: 16KB memoryviews of PRG ROM for $8000 and $c000,
+  and 1KB memoryviews of CHR ROM for each KB of PPU $0000-$1fff. The CPU and PPU read the tables directly, so a bank
+  switch only rewrites table entries and tells the listeners. Boards start out with the first 16KB of PRG ROM at
+  $8000, the last at $c000 and the first 8KB of CHR ROM mapped.
+  """
   def __init__(self, cart):
-    self._cart = cart 
+    self._cart = cart
+    self._prg_listeners = []
+    self._chr_listeners = []
+    self._mirroring_listeners = []
+
+    self.prg_banks = [None, None]
+    # The 16KB PRG ROM page in each slot of prg_banks
+    self.loaded_pages = [None, None]
+    # Left as None when the cartridge has CHR RAM, which is not banked
+    self.chr_banks = [None] * 8
+    # A PPU NAMETABLE_LAYOUTS name, or None while the cartridge header decides
+    self.layout = None
+
+    self.switch_prg(0x8000, 0)
+    self.switch_prg(0xc000, -1)
+    self.switch_chr(0x0000, 0)
 
   def mem_write(self, address, value):
     pass
 
   def boot(self):
     pass
+
+  def switch_prg(self, start, bank, size=0x4000):
+    """
+    Map bank number `bank` of PRG ROM, counted in `size` units and wrapping around, at CPU address start. A bank
+    larger than the whole ROM repeats it, as 16KB PRG does in both halves of a 32KB bank.
+    """
+    prg = self._cart._prg_view
+    pages = len(prg) >> 14
+    page = (bank % max(len(prg) // size, 1)) * (size >> 14)
+    for slot in range((start - 0x8000) >> 14, (start - 0x8000 + size) >> 14):
+      page %= pages
+      self.loaded_pages[slot] = page
+      self.prg_banks[slot] = prg[page * 0x4000:(page + 1) * 0x4000]
+      page += 1
+    self.prg_switched(start, start + size)
+
+  def switch_chr(self, start, bank, size=0x2000):
+    """
+    Map bank number `bank` of CHR ROM, counted in `size` units and wrapping around, at PPU address start
+    """
+    chr = self._cart._chr_view
+    if not len(chr):
+      return
+    offset = (bank % max(len(chr) // size, 1)) * size
+    for slot in range(start >> 10, (start + size) >> 10):
+      self.chr_banks[slot] = chr[offset:offset + 0x400]
+      offset += 0x400
+    self.chr_switched(start, start + size)
+
+  def set_mirroring(self, layout):
+    if layout != self.layout:
+      self.layout = layout
+      for listener in self._mirroring_listeners:
+        listener(layout)
+
+  def add_prg_listener(self, listener):
+    """
+    Register a callable(start, end) to be told when the PRG ROM mapped to [start, end) changes
+    """
+    self._prg_listeners.append(listener)
+
+  def prg_switched(self, start, end):
+    for listener in self._prg_listeners:
+      listener(start, end)
+
+  def add_chr_listener(self, listener):
+    """
+    Register a callable(start, end) to be told when the CHR mapped to PPU addresses [start, end) changes
+    """
+    self._chr_listeners.append(listener)
+
+  def chr_switched(self, start, end):
+    for listener in self._chr_listeners:
+      listener(start, end)
+
+  def add_mirroring_listener(self, listener):
+    """
+    Register a callable(layout) to be told when the mapper changes the nametable layout
+    """
+    self._mirroring_listeners.append(listener)
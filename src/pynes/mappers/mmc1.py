@@ -1,71 +1,76 @@
-from mappers import Mapper
-from utils import Enumerate
+from mappers.mapper import Mapper, register
 import logging
 
 log = logging.getLogger("PyNES")
 
+# Nametable layout for each value of the low two bits of the control register
+LAYOUTS = ('SINGLE_LOWER', 'SINGLE_UPPER', 'VERTICAL', 'HORIZONTAL')
 
-class MMC1(Mapper):
-    mirroring = Enumerate("SINGLE_LOWER SINGLE_UPPER VERTICAL HORIZONTAL")
 
+@register(1)
+class MMC1(Mapper):
     def __init__(self, cartridge):
-        super().__init__(cartridge)
-        self.loaded_pages = [0, cartridge._prg_rom_pages - 1]
-
         self.register_buffer = 0
         self.write_count = 0
 
-        # Variables controlled by register 1
-        self.mirroring = None
-        self.vrom_swap_4k = False
-        self.swap_low = False
-        self.swap_32k = False
-
-        # Variables controlled by register 2
-        self.vrom_bank_number_1 = 0
-        self.selection_register_0 = 0
-
-        # Register 3
-        self.vrom_bank_number_2 = 0
-        self.selection_register_1 = 0
+        # Register 0 ($8000): mirroring, PRG bank mode and CHR bank mode. Power on in PRG mode 3, with the last bank
+        # fixed at $c000.
+        self.control = 0x0c
+        # Registers 1 and 2 ($a000, $c000): CHR banks for $0000 and $1000, in 4KB units
+        self.chr_bank_0 = 0
+        self.chr_bank_1 = 0
+        # Register 3 ($e000): PRG bank
+        self.prg_bank = 0
 
-        # Register 4
-        self.prg_rom_bank_number = 0
+        super().__init__(cartridge)
 
     def mem_write(self, address, value):
         if value & (1 << 7):
             self.register_buffer = 0
             self.write_count = 0
+            self.control |= 0x0c
+            self.update_prg()
             return
-        if self.write_count < 5:
-            self.register_buffer += ((value & 1) << self.write_count)
-            self.write_count += 1
+        self.register_buffer |= (value & 1) << self.write_count
+        self.write_count += 1
         if self.write_count == 5:
             log.debug('Writing value {0:b} to mapper address {1:#4x}'.format(self.register_buffer, address))
             # Transfer the buffered data to the registers.
-            if 0x8000 <= address < 0xa000:
-                self.mirroring = self.register_buffer & 0b11
-                self.swap_low = bool(self.register_buffer & 0b100)
-                self.swap_32k = not bool(self.register_buffer & 0b1000)
-                self.vrom_swap_4k = bool(self.register_buffer & 0b10000)
-
-            elif 0xa000 <= address < 0xc000:
-                self.vrom_bank_number_1 = self.register_buffer & 0b1111
-                self.vrom_selection_register_0 = self.register_buffer >> 5
-
-            elif 0xc000 <= address < 0xe000:
-                self.vrom_bank_number_2 = self.register_buffer & 0b1111
-                self.vrom_selection_register_1 = self.register_buffer >> 5
-
-            elif 0xe000 <= address < 0x10000:
-                bank = self.register_buffer & 0b1111
-                if self.swap_32k:
-                    self.loaded_pages = [bank * 2, (bank * 2) + 1]
-                elif self.swap_low:
-                    self.loaded_pages[0] = bank
-                else:
-                    self.loaded_pages[1] = bank
+            if address < 0xa000:
+                self.control = self.register_buffer
+                self.set_mirroring(LAYOUTS[self.control & 0b11])
+                self.update_prg()
+                self.update_chr()
+            elif address < 0xc000:
+                self.chr_bank_0 = self.register_buffer
+                self.update_chr()
+            elif address < 0xe000:
+                self.chr_bank_1 = self.register_buffer
+                self.update_chr()
+            else:
+                self.prg_bank = self.register_buffer & 0b1111
+                self.update_prg()
 
             # Reset the buffer and write count
             self.register_buffer = 0
             self.write_count = 0
+
+    def update_prg(self):
+        mode = (self.control >> 2) & 0b11
+        if mode < 2:
+            # 32KB at $8000, ignoring the low bit of the bank number
+            self.switch_prg(0x8000, self.prg_bank >> 1, 0x8000)
+        elif mode == 2:
+            self.switch_prg(0x8000, 0)
+            self.switch_prg(0xc000, self.prg_bank)
+        else:
+            self.switch_prg(0x8000, self.prg_bank)
+            self.switch_prg(0xc000, -1)
+
+    def update_chr(self):
+        if self.control & 0b10000:
+            self.switch_chr(0x0000, self.chr_bank_0, 0x1000)
+            self.switch_chr(0x1000, self.chr_bank_1, 0x1000)
+        else:
+            # 8KB at $0000, ignoring the low bit of the bank number
+            self.switch_chr(0x0000, self.chr_bank_0 >> 1)
@@ -0,0 +1,9 @@
+from mappers.mapper import Mapper, register
+
+
+@register(0)
+class NROM(Mapper):
+    """
+    No bank switching: 16KB of PRG ROM mirrored at $8000 and $c000, or 32KB, and 8KB of CHR.
+    """
+    pass
@@ -0,0 +1,12 @@
+from mappers.mapper import Mapper, register
+
+
+@register(2)
+class UxROM(Mapper):
+    """
+    Switchable 16KB PRG bank at $8000 and the last bank fixed at $c000. CHR is 8KB, usually RAM.
+    """
+    def mem_write(self, address, value):
+        # The board does not decode writes away from the ROM, so the value is ANDed with the byte at the address.
+        value &= self.prg_banks[(address >> 14) & 1][address & 0x3fff]
+        self.switch_prg(0x8000, value)
@@ -0,0 +1,133 @@
+"""
+PyNES - Frame pacing
+
+FramePacer decides how many frames to emulate each time the frontend polls it. It follows either a high resolution
+clock, scheduling frame n at n / FRAME_RATE seconds after the start, or the audio device, keeping the playback ring
+buffer filled to a target level. Either way it never runs more than `max_catch_up` frames in one go. On the clock,
+falling further behind than that gives up on the missed frames instead of spiralling.
+"""
+
+import logging
+import time
+import numpy as np
+from papu import CPU_CLOCK
+from scheduler import DOTS_PER_CPU_CYCLE, DOTS_PER_SCANLINE, SCANLINES_PER_FRAME
+
+__author__ = 'misha'
+
+log = logging.getLogger("PyNES")
+
+# NTSC frames per second, about 60.0988.
+FRAME_RATE = CPU_CLOCK * DOTS_PER_CPU_CYCLE / (DOTS_PER_SCANLINE * SCANLINES_PER_FRAME)
+
+# Frame time histogram buckets, in whole milliseconds. The last bucket holds everything slower.
+HISTOGRAM_BUCKETS = 50
+
+
+class FramePacer:
+    def __init__(self, console, audio=None, max_catch_up=4, fill=0.5, clock=time.perf_counter):
+        """
+        Pace `console` to the clock, or to `audio` (an audio.AudioOutput) when given, keeping its ring buffer `fill`
+        full.
+        """
+        self._console = console
+        self._audio = audio
+        self._clock = clock
+        self.max_catch_up = max_catch_up
+        if audio is not None:
+            self._target_fill = int(audio.ring.capacity * fill)
+            self._samples_per_frame = audio.rate / FRAME_RATE
+
+        self._start = None
+        # Frames emulated, and the frame number the clock schedule is at (ahead of `frames` by any dropped ones).
+        self.frames = 0
+        self._scheduled = 0
+
+        # Metrics: emulation time per frame in millisecond buckets, frames finished after the next one was due, and
+        # frames given up on to catch up.
+        self.histogram = np.zeros(HISTOGRAM_BUCKETS + 1, dtype=np.int64)
+        self.late = 0
+        self.dropped = 0
+
+    def due(self):
+        """
+        The number of frames to run now.
+        """
+        now = self._clock()
+        if self._start is None:
+            self._start = now
+
+        if self._audio is not None:
+            missing = self._target_fill - len(self._audio.ring)
+            due = int(np.ceil(missing / self._samples_per_frame)) if missing > 0 else 0
+        else:
+            due = int((now - self._start) * FRAME_RATE) + 1 - self._scheduled
+
+        if due > self.max_catch_up:
+            # The clock schedule skips ahead; the audio buffer just refills over the next few polls.
+            if self._audio is None:
+                self.dropped += due - self.max_catch_up
+                self._scheduled += due - self.max_catch_up
+            due = self.max_catch_up
+        return max(due, 0)
+
+    def tick(self):
+        """
+        Run the frames due now. Returns how many were run.
+        """
+        due = self.due()
+        for _ in range(due):
+            self.run_frame()
+        return due
+
+    def run_frame(self):
+        start = self._clock()
+        if self._start is None:
+            self._start = start
+        self._console.run_frame()
+        end = self._clock()
+
+        self.histogram[min(int((end - start) * 1000), HISTOGRAM_BUCKETS)] += 1
+        self._scheduled += 1
+        self.frames += 1
+        # Frame n is due at n / FRAME_RATE, so it is late if it finishes after frame n + 1 is due.
+        if self._audio is None and end - self._start > self._scheduled / FRAME_RATE:
+            self.late += 1
+
+    def wait(self):
+        """
+        Sleep until the next frame is due on the clock.
+        """
+        if self._start is not None:
+            delay = self._start + self._scheduled / FRAME_RATE - self._clock()
+            if delay > 0:
+                time.sleep(delay)
+
+    def drift(self):
+        """
+        Seconds of emulated time ahead of (positive) or behind (negative) the wall clock since the first frame.
+        """
+        if self._start is None:
+            return 0.0
+        return self.frames / FRAME_RATE - (self._clock() - self._start)
+
+    def report(self):
+        """
+        The metrics as text: frame count, drift, late and dropped frames (or audio underruns and overruns when paced by
+        audio), and frame time percentiles.
+        """
+        if self._audio is None:
+            lines = ["{0} frames, drift {1:+.3f}s, {2} late, {3} dropped".format(self.frames, self.drift(), self.late,
+                                                                                  self.dropped)]
+        else:
+            ring = self._audio.ring
+            lines = ["{0} frames, drift {1:+.3f}s, {2} audio underruns, {3} overruns".format(
+                self.frames, self.drift(), ring.underruns, ring.overruns)]
+        if self.frames:
+            cumulative = np.cumsum(self.histogram) / self.frames
+            for percentile in (0.5, 0.9, 0.99):
+                bucket = int(np.searchsorted(cumulative, percentile))
+                lines.append("  p{0:<2.0f} frame time < {1} ms".format(percentile * 100, bucket + 1)
+                             if bucket < HISTOGRAM_BUCKETS else
+                             "  p{0:<2.0f} frame time >= {1} ms".format(percentile * 100, HISTOGRAM_BUCKETS))
+        return "\n".join(lines)
@@ -1,6 +1,555 @@
-class Papu(object):
+"""
+PyNES - Audio processing unit
+
+The channels are never clocked one cycle at a time. Register writes are applied at the CPU cycle they happen, and
+between writes and frame counter steps each channel's parameters are fixed, so its output for the whole stretch is
+synthesized at once with NumPy. Output is one sample per APU cycle (every other CPU cycle), mixed with the 2A03's
+nonlinear mixer.
+"""
+
+import logging
+import numpy as np
+
+__author__ = 'misha'
+
+log = logging.getLogger("PyNES")
+
+# NTSC CPU clock. The APU runs at half of it and produces one sample per APU cycle.
+CPU_CLOCK = 1789773
+SAMPLE_RATE = CPU_CLOCK / 2
+
+LENGTHS = [10, 254, 20, 2, 40, 4, 80, 6, 160, 8, 60, 10, 14, 12, 26, 14,
+           12, 16, 24, 18, 48, 20, 96, 22, 192, 24, 72, 26, 16, 28, 32, 30]
+
+DUTIES = np.array([[0, 1, 0, 0, 0, 0, 0, 0],
+                   [0, 1, 1, 0, 0, 0, 0, 0],
+                   [0, 1, 1, 1, 1, 0, 0, 0],
+                   [1, 0, 0, 1, 1, 1, 1, 1]], dtype=np.uint8)
+
+TRIANGLE = np.array(list(range(15, -1, -1)) + list(range(16)), dtype=np.uint8)
+
+# Noise and DMC timer periods, in APU cycles.
+NOISE_PERIODS = [2, 4, 8, 16, 32, 48, 64, 80, 101, 127, 190, 254, 381, 508, 1017, 2034]
+DMC_PERIODS = [214, 190, 170, 160, 143, 127, 113, 107, 95, 80, 71, 64, 53, 42, 36, 27]
+
+# Frame counter steps, in CPU cycles after $4017 is written, and the sequence length for the 4- and 5-step modes.
+# Every step clocks the envelopes and triangle linear counter; HALF_FRAMES also clock the length counters and sweeps.
+FRAME_STEPS = ([7457, 14913, 22371, 29829], [7457, 14913, 22371, 37281])
+FRAME_PERIODS = (29830, 37282)
+HALF_FRAMES = (1, 3)
+
+# The 2A03 mixer, indexed by pulse1 + pulse2 and by 3 * triangle + 2 * noise + dmc.
+PULSE_MIX = np.array([0.0] + [95.52 / (8128.0 / n + 100) for n in range(1, 31)], dtype=np.float32)
+TND_MIX = np.array([0.0] + [163.67 / (24329.0 / n + 100) for n in range(1, 203)], dtype=np.float32)
+
+
+def advance(period, left, n):
+  """
+  Run a timer that is `left` cycles from expiring and reloads to `period` for n cycles. Returns how many times it
+  expires before each of the n cycles, and the new `left`. The first expiry is seen from cycle index `left` on.
+  """
+  offset = period - left
+  return offset, (offset + n) // period, period - (offset + n) % period
+
+
+class NoiseCycles:
+  """
+  The shift register sequences of the noise channel. The register is an invertible LFSR, so every state lies on a
+  cycle; each cycle is generated once, the first time the channel enters it.
+  """
   def __init__(self):
-    pass
+    self._cycles = {0: [], 1: []}
+    self._index = {0: np.full(0x8000, -1, dtype=np.intp), 1: np.full(0x8000, -1, dtype=np.intp)}
+    self._position = {0: np.zeros(0x8000, dtype=np.intp), 1: np.zeros(0x8000, dtype=np.intp)}
+
+  def find(self, mode, state):
+    """
+    The cycle of states through `state` in the given mode, and the position of `state` in it.
+    """
+    index = self._index[mode][state]
+    if index < 0:
+      tap = 6 if mode else 1
+      states = [state]
+      value = state
+      while True:
+        value = (value >> 1) | (((value ^ (value >> tap)) & 1) << 14)
+        if value == state:
+          break
+        states.append(value)
+      cycle = np.array(states, dtype=np.uint16)
+      index = len(self._cycles[mode])
+      self._cycles[mode].append(cycle)
+      self._index[mode][cycle] = index
+      self._position[mode][cycle] = np.arange(len(cycle))
+    return self._cycles[mode][index], int(self._position[mode][state])
+
+
+class Papu(object):
+  class Envelope:
+    """
+    Volume envelope shared by the pulse and noise channels, clocked every frame counter step.
+    """
+    def __init__(self):
+      self.constant = False
+      self.loop = False
+      self.period = 0
+      self.start = False
+      self.divider = 0
+      self.decay = 0
+
+    def write(self, value):
+      self.loop = bool(value & 0x20)
+      self.constant = bool(value & 0x10)
+      self.period = value & 0xf
+
+    def clock(self):
+      if self.start:
+        self.start = False
+        self.decay = 15
+        self.divider = self.period
+      elif self.divider:
+        self.divider -= 1
+      else:
+        self.divider = self.period
+        if self.decay:
+          self.decay -= 1
+        elif self.loop:
+          self.decay = 15
+
+    @property
+    def volume(self):
+      return self.period if self.constant else self.decay
+
+  class Channel:
+    """
+    State every channel shares: its output buffer row, the APU cycle it has been synthesized up to, and the length
+    counter.
+    """
+    def __init__(self, apu, row):
+      self._apu = apu
+      self.row = row
+      self.clock = 0
+      self.enabled = False
+      self.length = 0
+      self.halt = False
+
+    def run(self, until):
+      """
+      Synthesize output up to APU cycle `until`.
+      """
+      n = until - self.clock
+      if n > 0:
+        start = self.clock - self._apu.base
+        self.synthesize(self._apu.outputs[self.row, start:start + n])
+        self.clock = until
+
+    def load_length(self, value):
+      if self.enabled:
+        self.length = LENGTHS[value >> 3]
+
+    def set_enabled(self, enabled):
+      self.enabled = enabled
+      if not enabled:
+        self.length = 0
+
+    def clock_length(self):
+      if self.length and not self.halt:
+        self.length -= 1
+
+  class Pulse(Channel):
+    def __init__(self, apu, row):
+      Papu.Channel.__init__(self, apu, row)
+      self.envelope = Papu.Envelope()
+      self.duty = 0
+      self.timer = 0
+      self.step = 0
+      self.left = 1
+      self.sweep_enabled = False
+      self.sweep_period = 0
+      self.sweep_negate = False
+      self.sweep_shift = 0
+      self.sweep_reload = False
+      self.sweep_divider = 0
+      # Pulse 1 negates in ones' complement, pulse 2 in twos' complement.
+      self._negate_bias = 1 if row == 0 else 0
+
+    def write(self, register, value):
+      if register == 0:
+        self.duty = value >> 6
+        self.halt = bool(value & 0x20)
+        self.envelope.write(value)
+      elif register == 1:
+        self.sweep_enabled = bool(value & 0x80)
+        self.sweep_period = (value >> 4) & 0x7
+        self.sweep_negate = bool(value & 0x8)
+        self.sweep_shift = value & 0x7
+        self.sweep_reload = True
+      elif register == 2:
+        self.timer = (self.timer & 0x700) | value
+      else:
+        self.timer = (self.timer & 0xff) | ((value & 0x7) << 8)
+        self.load_length(value)
+        self.envelope.start = True
+        self.step = 0
+
+    def sweep_target(self):
+      change = self.timer >> self.sweep_shift
+      if self.sweep_negate:
+        return self.timer - change - self._negate_bias
+      return self.timer + change
+
+    def clock_sweep(self):
+      target = self.sweep_target()
+      if not self.sweep_divider and self.sweep_enabled and self.sweep_shift and self.timer >= 8 and target <= 0x7ff:
+        self.timer = target
+      if not self.sweep_divider or self.sweep_reload:
+        self.sweep_divider = self.sweep_period
+        self.sweep_reload = False
+      else:
+        self.sweep_divider -= 1
+
+    def synthesize(self, out):
+      # The sequencer steps every (timer + 1) * 2 CPU cycles, which is timer + 1 APU cycles.
+      period = self.timer + 1
+      offset, steps, self.left = advance(period, self.left, len(out))
+      if self.length and self.timer >= 8 and self.sweep_target() <= 0x7ff:
+        levels = DUTIES[self.duty] * self.envelope.volume
+        np.take(levels, ((self.step * period + offset + self._apu.ramp[:len(out)]) // period) & 7, out=out)
+      else:
+        out[:] = 0
+      self.step = (self.step + steps) & 7
+
+  class Triangle(Channel):
+    def __init__(self, apu, row):
+      Papu.Channel.__init__(self, apu, row)
+      self.timer = 0
+      self.step = 0
+      self.left = 1
+      self.linear = 0
+      self.linear_reload = 0
+      self.reload = False
+
+    def write(self, register, value):
+      if register == 0:
+        self.halt = bool(value & 0x80)
+        self.linear_reload = value & 0x7f
+      elif register == 2:
+        self.timer = (self.timer & 0x700) | value
+      elif register == 3:
+        self.timer = (self.timer & 0xff) | ((value & 0x7) << 8)
+        self.load_length(value)
+        self.reload = True
+
+    def clock_linear(self):
+      if self.reload:
+        self.linear = self.linear_reload
+      elif self.linear:
+        self.linear -= 1
+      # The length counter halt flag doubles as the linear counter control flag.
+      if not self.halt:
+        self.reload = False
+
+    def synthesize(self, out):
+      # The triangle timer runs at the CPU clock, so it is clocked twice per sample. It stops, holding its output,
+      # when either counter is zero. Ultrasonic periods are stopped too, rather than played as a pop.
+      if not (self.length and self.linear) or self.timer < 2:
+        out[:] = TRIANGLE[self.step]
+        return
+      period = self.timer + 1
+      offset, steps, self.left = advance(period, self.left, 2 * len(out))
+      np.take(TRIANGLE, ((self.step * period + offset + 2 * self._apu.ramp[:len(out)]) // period) & 31, out=out)
+      self.step = (self.step + steps) & 31
+
+  class Noise(Channel):
+    def __init__(self, apu, row):
+      Papu.Channel.__init__(self, apu, row)
+      self.envelope = Papu.Envelope()
+      self.period = NOISE_PERIODS[0]
+      self.left = 1
+      self.mode = 0
+      self.cycle, self.position = apu.noise_cycles.find(0, 1)
+
+    def write(self, register, value):
+      if register == 0:
+        self.halt = bool(value & 0x20)
+        self.envelope.write(value)
+      elif register == 2:
+        self.period = NOISE_PERIODS[value & 0xf]
+        mode = value >> 7
+        if mode != self.mode:
+          self.mode = mode
+          self.cycle, self.position = self._apu.noise_cycles.find(mode, int(self.cycle[self.position]))
+      elif register == 3:
+        self.load_length(value)
+        self.envelope.start = True
+
+    def synthesize(self, out):
+      n = len(out)
+      offset, shifts, self.left = advance(self.period, self.left, n)
+      if self.length:
+        # Bit 0 of the shift register set mutes the channel.
+        shifted = (self.position + (offset + self._apu.ramp[:n]) // self.period) % len(self.cycle)
+        np.take(self.cycle, shifted, out=self._apu.scratch[:n])
+        np.subtract(1, self._apu.scratch[:n] & 1, out=out, casting='unsafe')
+        out *= self.envelope.volume
+      else:
+        out[:] = 0
+      self.position = (self.position + shifts) % len(self.cycle)
+
+  class DMC(Channel):
+    def __init__(self, apu, row):
+      Papu.Channel.__init__(self, apu, row)
+      self.irq_enabled = False
+      self.irq = False
+      self.loop = False
+      self.period = DMC_PERIODS[0]
+      self.left = 1
+      self.level = 0
+      self.sample_address = 0xc000
+      self.sample_length = 1
+      self.address = 0xc000
+      self.remaining = 0
+      # Bits fetched but not yet played, least significant first.
+      self.bits = np.zeros(0, dtype=np.uint8)
+
+    def write(self, register, value):
+      if register == 0:
+        self.irq_enabled = bool(value & 0x80)
+        self.loop = bool(value & 0x40)
+        self.period = DMC_PERIODS[value & 0xf]
+        if not self.irq_enabled:
+          self.set_irq(False)
+      elif register == 1:
+        self.level = value & 0x7f
+      elif register == 2:
+        self.sample_address = 0xc000 | (value << 6)
+      else:
+        self.sample_length = (value << 4) | 1
+
+    def set_irq(self, irq):
+      self.irq = irq
+      cpu = self._apu.cpu
+      if irq:
+        cpu.assert_interrupt(cpu.IRQ_DMC)
+      else:
+        cpu.release_interrupt(cpu.IRQ_DMC)
+
+    def set_enabled(self, enabled):
+      self.enabled = enabled
+      if not enabled:
+        self.remaining = 0
+      elif not self.remaining:
+        self.restart()
+
+    def restart(self):
+      self.address = self.sample_address
+      self.remaining = self.sample_length
+
+    def irq_cycle(self):
+      """
+      The APU cycle the last byte of a sample that ends in an IRQ is fetched, or None.
+      """
+      if not self.irq_enabled or self.loop or not self.remaining:
+        return None
+      return self.clock + self.left + (len(self.bits) + (self.remaining - 1) * 8) * self.period
+
+    def fetch(self, count):
+      """
+      Fetch sample bytes until `count` bits are pending or the sample ends.
+      """
+      read = self._apu.cpu.memory.read
+      fetched = []
+      needed = (count - len(self.bits) + 7) >> 3
+      while needed > 0 and self.remaining:
+        fetched.append(read(self.address))
+        self.address = 0x8000 | ((self.address + 1) & 0x7fff)
+        self.remaining -= 1
+        needed -= 1
+        if not self.remaining:
+          if self.loop:
+            self.restart()
+          elif self.irq_enabled:
+            self.set_irq(True)
+      if fetched:
+        fetched = np.unpackbits(np.array(fetched, dtype=np.uint8), bitorder='little')
+        self.bits = np.concatenate((self.bits, fetched))
+
+    def synthesize(self, out):
+      n = len(out)
+      first = self.left
+      offset, clocks, self.left = advance(self.period, self.left, n)
+      if clocks and len(self.bits) < clocks:
+        self.fetch(clocks)
+      played = self.bits[:clocks]
+      self.bits = self.bits[clocks:]
+      if not len(played):
+        out[:] = self.level
+        return
+
+      # The output level moves by 2 for each bit played, and stays put rather than wrap past 0 or 127.
+      levels = [self.level]
+      level = self.level
+      for bit in played.tolist():
+        if bit:
+          if level <= 125:
+            level += 2
+        elif level >= 2:
+          level -= 2
+        levels.append(level)
+      self.level = level
+      counts = [min(first, n)] + [self.period] * len(played)
+      counts[-1] = n - sum(counts[:-1])
+      if counts[-1] < 0:
+        counts[-1] = 0
+      out[:] = np.repeat(np.array(levels, dtype=np.uint8), counts)[:n]
+
+  def __init__(self, console):
+    self._console = console
+    self.cpu = console.CPU
+    self.noise_cycles = NoiseCycles()
+
+    # One row of output levels per channel, from APU cycle self.base on. Grown if a block gets long.
+    self.base = 0
+    self.outputs = np.zeros((5, 0x8000), dtype=np.uint8)
+    self.ramp = np.arange(0x8000, dtype=np.intp)
+    self.scratch = np.zeros(0x8000, dtype=np.uint16)
+    self._sample_listeners = []
+
+    self.pulse1 = Papu.Pulse(self, 0)
+    self.pulse2 = Papu.Pulse(self, 1)
+    self.triangle = Papu.Triangle(self, 2)
+    self.noise = Papu.Noise(self, 3)
+    self.dmc = Papu.DMC(self, 4)
+    self.channels = [self.pulse1, self.pulse2, self.triangle, self.noise, self.dmc]
+
+    # Frame counter: mode (0 for 4-step, 1 for 5-step), the CPU cycle its sequence started and the next step.
+    self.frame_mode = 0
+    self.frame_irq_inhibit = False
+    self.frame_irq = False
+    self._sequence_start = 0
+    self._step = 0
+    # The CPU cycle of the next frame counter step or DMC IRQ. The scheduler catches the APU up when it is reached.
+    self.next_event = FRAME_STEPS[0][0]
+
+  def add_sample_listener(self, listener):
+    """
+    Register a callable(samples) to be given each block of mixed output: float32 samples at SAMPLE_RATE
+    """
+    self._sample_listeners.append(listener)
 
   def register_write(self, address, value):
-    pass
+    cycle = self._console.scheduler.clock
+    self.catch_up(cycle)
+    now = cycle >> 1
+    if address < 0x4014:
+      channel = self.channels[(address >> 2) & 0x7]
+      self._run(channel, now)
+      channel.write(address & 0x3, value)
+    elif address == 0x4015:
+      for channel in self.channels:
+        self._run(channel, now)
+      for bit, channel in enumerate(self.channels):
+        channel.set_enabled(bool(value & (1 << bit)))
+      self.dmc.set_irq(False)
+    elif address == 0x4017:
+      for channel in self.channels:
+        self._run(channel, now)
+      self.frame_mode = value >> 7
+      self.frame_irq_inhibit = bool(value & 0x40)
+      if self.frame_irq_inhibit:
+        self._set_frame_irq(False)
+      self._sequence_start = cycle
+      self._step = 0
+      if self.frame_mode:
+        self._clock_frame(True)
+    self._schedule()
+
+  def read_status(self):
+    """
+    $4015: which length counters are running and which IRQs are pending. Reading it acknowledges the frame IRQ.
+    """
+    cycle = self._console.scheduler.clock
+    self.catch_up(cycle)
+    self._run(self.dmc, cycle >> 1)
+    value = int(bool(self.dmc.remaining)) << 4
+    for bit, channel in enumerate(self.channels[:4]):
+      if channel.length:
+        value |= 1 << bit
+    value |= int(self.frame_irq) << 6
+    value |= int(self.dmc.irq) << 7
+    self._set_frame_irq(False)
+    self._schedule()
+    return value
+
+  def catch_up(self, cycle):
+    """
+    Apply every frame counter step and DMC IRQ due by the given CPU cycle.
+    """
+    while self.next_event <= cycle:
+      steps = FRAME_STEPS[self.frame_mode]
+      step_cycle = self._sequence_start + steps[self._step]
+      if step_cycle <= cycle and step_cycle == self.next_event:
+        for channel in self.channels:
+          self._run(channel, step_cycle >> 1)
+        self._clock_frame(self._step in HALF_FRAMES)
+        if self._step == 3:
+          if not self.frame_mode and not self.frame_irq_inhibit:
+            self._set_frame_irq(True)
+          self._sequence_start += FRAME_PERIODS[self.frame_mode]
+        self._step = (self._step + 1) & 3
+      else:
+        self._run(self.dmc, self.next_event >> 1)
+      self._schedule()
+
+  def flush(self, cycle):
+    """
+    Synthesize every channel up to the given CPU cycle and hand the mixed block to the sample listeners.
+    """
+    self.catch_up(cycle)
+    now = cycle >> 1
+    for channel in self.channels:
+      self._run(channel, now)
+    n = now - self.base
+    if n > 0 and self._sample_listeners:
+      pulse1, pulse2, triangle, noise, dmc = self.outputs[:, :n].astype(np.intp)
+      samples = PULSE_MIX[pulse1 + pulse2] + TND_MIX[3 * triangle + 2 * noise + dmc]
+      for listener in self._sample_listeners:
+        listener(samples)
+    self.base = now
+
+  def _run(self, channel, until):
+    if until - self.base > self.outputs.shape[1]:
+      self._grow(until - self.base)
+    channel.run(until)
+
+  def _grow(self, size):
+    size = max(size, 2 * self.outputs.shape[1])
+    outputs = np.zeros((5, size), dtype=np.uint8)
+    outputs[:, :self.outputs.shape[1]] = self.outputs
+    self.outputs = outputs
+    self.ramp = np.arange(size, dtype=np.intp)
+    self.scratch = np.zeros(size, dtype=np.uint16)
+
+  def _clock_frame(self, half):
+    self.pulse1.envelope.clock()
+    self.pulse2.envelope.clock()
+    self.noise.envelope.clock()
+    self.triangle.clock_linear()
+    if half:
+      for channel in self.channels[:4]:
+        channel.clock_length()
+      self.pulse1.clock_sweep()
+      self.pulse2.clock_sweep()
+
+  def _set_frame_irq(self, irq):
+    self.frame_irq = irq
+    if irq:
+      self.cpu.assert_interrupt(self.cpu.IRQ_FRAME_COUNTER)
+    else:
+      self.cpu.release_interrupt(self.cpu.IRQ_FRAME_COUNTER)
+
+  def _schedule(self):
+    self.next_event = self._sequence_start + FRAME_STEPS[self.frame_mode][self._step]
+    dmc = self.dmc.irq_cycle()
+    if dmc is not None:
+      self.next_event = min(self.next_event, dmc << 1)
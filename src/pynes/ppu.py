@@ -3,86 +3,206 @@ PyNES - Picture Processing Unit (PPU) emulation
 """
 
 import logging
-import multiprocessing
-import threading
 import numpy as np
 import time
-import pyglet
+from scheduler import DOTS_PER_CPU_CYCLE, DOTS_PER_SCANLINE, SCANLINES_PER_FRAME
 
 
 log = logging.getLogger("PyNES")
 
 
-class PPU(threading.Thread):
+# Physical nametable (1KB page of VRAM) behind each of the four logical nametables at $2000, $2400, $2800 and $2c00.
+NAMETABLE_LAYOUTS = {
+    'HORIZONTAL': (0, 0, 1, 1),
+    'VERTICAL': (0, 1, 0, 1),
+    'SINGLE_LOWER': (0, 0, 0, 0),
+    'SINGLE_UPPER': (1, 1, 1, 1),
+    'FOUR_SCREEN': (0, 1, 2, 3),
+}
+
+# Palette RAM index for each address in $3f00 - $3f1f. The sprite backdrop entries alias the background ones.
+PALETTE_MIRROR = bytes(i & 0x0f if i & 0x13 == 0x10 else i for i in range(0x20))
+
+# Colour emphasis ($2001 bits 5-7) dims the two channels not being emphasized by about this much.
+EMPHASIS_ATTENUATION = 0.816
+
+
+def build_palette_lut(palette):
+    """
+    Expand the 64-colour master palette into an (8, 64, 3) RGB table, one plane per combination of the red, green
+    and blue emphasis bits.
+    """
+    base = np.array(palette, dtype=np.float64)
+    lut = np.empty((8, 64, 3), dtype=np.uint8)
+    for emphasis in range(8):
+        scale = np.ones(3)
+        for channel in range(3):
+            if emphasis & (1 << channel):
+                scale[[c for c in range(3) if c != channel]] *= EMPHASIS_ATTENUATION
+        lut[emphasis] = np.round(base * scale)
+    return lut
+
+
+# A scanline fetches 33 tiles so it can be shifted left by up to 7 pixels of fine X scroll.
+TILE_COLUMNS = np.arange(33)
+# Shift that brings each pixel's bit of a pattern byte down to bit 0, left to right.
+PIXEL_SHIFTS = np.arange(7, -1, -1, dtype=np.uint8)
+
+
+class PPU:
     class Memory:
+        """
+        PPU address space. Pattern tables come from the cartridge CHR (or CHR RAM), the nametables are 2KB of
+        VRAM (4KB for four-screen carts) seen through four aliased 1KB views, and the palette is 32 bytes.
+        """
         def __init__(self, console):
             self._console = console
-            self._ram = [0] * 0xffff
+            cart = console.Cart
+
+            # A copy of the CHR ROM banks the mapper has mapped, or CHR RAM when the cartridge has no CHR ROM. Only
+            # CHR RAM can be written through $2007.
+            self.chr = bytearray(0x2000)
+            self.chr_ram = not len(cart.chr_rom)
+            self._copy_chr(0, 0x2000)
+
+            if cart.mapper.layout is not None:
+                layout = cart.mapper.layout
+            elif cart.four_screen:
+                layout = 'FOUR_SCREEN'
+            elif cart.vertical_mirroring:
+                layout = 'VERTICAL'
+            else:
+                layout = 'HORIZONTAL'
+            self.vram = bytearray(0x1000 if layout == 'FOUR_SCREEN' else 0x800)
+            self._vram_view = memoryview(self.vram)
+            self.nametables = [None] * 4
+            self.layout = None
+            # Physical page and offset in vram of each logical nametable, for vectorized lookups.
+            self.pages = None
+            self.nametable_bases = np.zeros(4, dtype=np.intp)
+            self.set_mirroring(layout)
+
+            self.palette = bytearray(0x20)
+
+            # Change counters, so the renderer can tell what it has to draw again: one per row of tiles in each
+            # physical nametable, one for the palette and one bumped whenever CHR tiles are decoded.
+            self.row_versions = [0] * 0x80
+            self.palette_version = 0
+            self.chr_version = 0
+
+            # Every tile of both pattern tables decoded to 2-bit colour indices, tiles[tile, row, column]. Writes
+            # and CHR bank switches only mark tiles stale; they are decoded again before the next render.
+            self.tiles = np.zeros((0x200, 8, 8), dtype=np.uint8)
+            self.stale_tiles = set(range(0x200))
+            self.decode_tiles()
+
+        def set_mirroring(self, layout):
+            """
+            Point the four logical nametables at the physical ones, per NAMETABLE_LAYOUTS[layout].
+            """
+            self.layout = layout
+            self.pages = NAMETABLE_LAYOUTS[layout]
+            for table, page in enumerate(self.pages):
+                self.nametables[table] = self._vram_view[page * 0x400:(page + 1) * 0x400]
+                self.nametable_bases[table] = page * 0x400
+
+        def load(self, vram, chr, palette):
+            """
+            Replace the contents of VRAM, CHR and the palette with a snapshot, bumping the change counters only for
+            what actually differs.
+            """
+            old = np.frombuffer(self.vram, dtype=np.uint8).reshape(-1, 0x400)
+            new = np.frombuffer(vram, dtype=np.uint8)[:len(self.vram)].reshape(-1, 0x400)
+            for page in range(len(old)):
+                rows = (old[page, :0x3c0].reshape(30, 32) != new[page, :0x3c0].reshape(30, 32)).any(axis=1)
+                if (old[page, 0x3c0:] != new[page, 0x3c0:]).any():
+                    rows[:] = True
+                for row in np.flatnonzero(rows).tolist():
+                    self.row_versions[(page << 5) | row] += 1
+            old[:] = new
+
+            old = np.frombuffer(self.chr, dtype=np.uint8).reshape(0x200, 16)
+            new = np.frombuffer(chr, dtype=np.uint8).reshape(0x200, 16)
+            tiles = np.flatnonzero((old != new).any(axis=1))
+            if len(tiles):
+                old[:] = new
+                self.stale_tiles.update(tiles.tolist())
+
+            palette = bytes(palette)
+            if self.palette != palette:
+                self.palette[:] = palette
+                self.palette_version += 1
+
+        def chr_switched(self, start, end):
+            """
+            Copy in the CHR the mapper switched to at PPU addresses [start, end), and mark its tiles stale.
+            """
+            self._copy_chr(start, end)
+            self.stale_tiles.update(range(start >> 4, end >> 4))
+
+        def _copy_chr(self, start, end):
+            banks = self._console.Cart.mapper.chr_banks
+            for slot in range(start >> 10, end >> 10):
+                if banks[slot] is not None:
+                    self.chr[slot << 10:(slot + 1) << 10] = banks[slot]
+
+        def decode_tiles(self):
+            """
+            Decode the bit planes of every stale tile into self.tiles.
+            """
+            tiles = np.fromiter(self.stale_tiles, dtype=np.intp, count=len(self.stale_tiles))
+            self.stale_tiles.clear()
+            planes = np.frombuffer(self.chr, dtype=np.uint8).reshape(0x200, 2, 8)[tiles]
+            low = (planes[:, 0, :, None] >> PIXEL_SHIFTS) & 0x1
+            high = (planes[:, 1, :, None] >> PIXEL_SHIFTS) & 0x1
+            self.tiles[tiles] = low | (high << 1)
+            self.chr_version += 1
 
         def write(self, address, value):
-            # log.debug("PPU Memory Write to address {0:#06x}".format(address))
-            if address < 0 or address > 0xffff:
-                raise Exception("Memory write out of bounds: {0x:#4x}".format(address))
+            # $0000 - $3fff, mirrored up to $ffff
+            address &= 0x3fff
 
             # Pattern Tables
             if address < 0x2000:
-                self._ram[address] = np.uint8(value)
-
-            # Name tables are mirrored in 0x3000 - 0x3eff
-            elif 0x2000 <= address < 0x3f00:
-                t_address = address - 0x2000
-                t_address %= 0x1000
-                self._ram[t_address + 0x2000] = np.uint8(value)
-
-            # Palettes are mirrored in 0x3f20 - 0x3fff
-            elif 0x3f00 <= address < 0x4000:
-                t_address = address - 0x3f00
-                # Background color is mirrored every 4 bytes.
-                if t_address % 4 == 0:
-                    t_address = 0
-                t_address %= 0x20
-                self._ram[t_address + 0x3f00] = np.uint8(value)
-
-            # Mirrors 0x0000 - 0x3fff
-            elif address >= 0x4000:
-                self.write(address % 0x4000, value)
-
+                if self.chr_ram:
+                    self.chr[address] = value
+                    self.stale_tiles.add(address >> 4)
+
+            # Name tables, mirrored in 0x3000 - 0x3eff
+            elif address < 0x3f00:
+                table = (address >> 10) & 3
+                offset = address & 0x3ff
+                self.nametables[table][offset] = value
+                row = (self.pages[table] << 5) | (offset >> 5)
+                if offset < 0x3c0:
+                    self.row_versions[row] += 1
+                else:
+                    # Attribute bytes cover four rows of tiles.
+                    first = (self.pages[table] << 5) | (((offset - 0x3c0) >> 3) << 2)
+                    for row in range(first, first + 4):
+                        self.row_versions[row] += 1
+
+            # Palettes, mirrored in 0x3f20 - 0x3fff
             else:
-                raise Exception("Unhandled memory write to address {0:#4x}".format(address))
+                self.palette[PALETTE_MIRROR[address & 0x1f]] = value & 0x3f
+                self.palette_version += 1
 
         def read(self, address):
-            # log.debug("Memory read from address {0:#4x}".format(address))
-            if address < 0 or address > 0xffff:
-                raise Exception("Memory read out of bounds: {0:#4x}".format(address))
+            address &= 0x3fff
 
-            # Pattern Tables
             if address < 0x2000:
-                return np.uint8(self._ram[address])
-
-            # Name Tables (mirrored in 0x3000 - 0x3eff)
-            elif 0x2000 <= address < 0x3f00:
-                t_address = address - 0x2000
-                t_address %= 0x1000
-                return np.uint8(self._ram[t_address + 0x2000])
-
-            # Palettes
-            elif 0x3f00 <= address < 0x4000:
-                t_address = address - 0x3f00
-                # Background color is mirrored every 4 bytes
-                if t_address % 4 == 0:
-                    t_address = 0
-                return np.uint8(self._ram[t_address + 0x3f00])
-
-            elif address >= 0x4000:
-                return self.read(address % 0x4000)
-
+                return self.chr[address]
+            elif address < 0x3f00:
+                return self.nametables[(address >> 10) & 3][address & 0x3ff]
             else:
-                raise Exception("Unhandled memory read at {0:#4x}".format(address))
+                return self.palette[PALETTE_MIRROR[address & 0x1f]]
 
     def __init__(self, console):
         log.debug('PPU: Initializing PPU...')
 
         self.memory = PPU.Memory(console)
+        self._vram = np.frombuffer(self.memory.vram, dtype=np.uint8)
+        self._palette_ram = np.frombuffer(self.memory.palette, dtype=np.uint8)
         self._console = console
         self._palette = [(0x75, 0x75, 0x75),
                          (0x27, 0x1b, 0x8f),
@@ -148,8 +268,28 @@ class PPU(threading.Thread):
                          (0x00, 0x00, 0x00),
                          (0x00, 0x00, 0x00),
                          (0x00, 0x00, 0x00)]
-
-        self._sprite_ram = [0] * 0x100
+        self._palette_lut = build_palette_lut(self._palette)
+
+        # Frame buffers, reused every frame: the palette RAM index of every pixel drawn, the master palette colour
+        # it resolved to, and the final RGB picture.
+        self.picture = np.zeros((240, 256), dtype=np.uint8)
+        self._colors = np.zeros((240, 256), dtype=np.uint8)
+        self.rgb = np.zeros((240, 256, 3), dtype=np.uint8)
+
+        # The background layer is kept between frames, and a line is only drawn again when the state it was drawn
+        # from (see _background_key) changes. The RGB picture is only rebuilt when the frame or palette changed.
+        self.background = np.zeros((240, 256), dtype=np.uint8)
+        self._background_keys = [None] * 240
+        self._picture_changed = True
+        self._sprites_drawn = False
+        self._sprites_drawn_before = False
+        self._rgb_key = None
+
+        # Object attribute memory: Y, tile, attributes and X for each of the 64 sprites.
+        self.oam = np.zeros((64, 4), dtype=np.uint8)
+        self._oam_bytes = self.oam.reshape(-1)
+        self.control_1 = 0
+        self.control_2 = 0
         self.address_increment = 1
         self.sprite_pattern_table = 0x0000
         self.background_pattern_table = 0x0000
@@ -163,11 +303,12 @@ class PPU(threading.Thread):
         self.color_intensity = 0
         self.accept_vram_writes = True
         self.scanline_sprite_count = 0
+        self.sprite_overflow = False
         self.sprite_0_hit = False
-        self.vblank = False  # Used to accurately reset cycle counter
+        self.vblank = False
         self._vblank = False  # Status flag, cleared when status is read
 
-        self.spr_ram_addr = multiprocessing.Value('B', 0)
+        self.spr_ram_addr = 0
         self.vram_addr = 0
         self.temp_vram_addr = 0
         self.fine_y = 0
@@ -175,14 +316,39 @@ class PPU(threading.Thread):
         self.vert_scroll_reg = True
         self.reg_write_toggle = True
 
-        self.starting_scanline = 0
-        self.sprites_to_draw = []
-        self.frame = pyglet.graphics.Batch()
+        # Timing, in PPU dots since power on. The PPU is only ever caught up a whole scanline at a time.
+        self.scanline = 0
+        self.scanline_start = 0
+        self.frame_count = 0
+
+        # Register accesses this frame as (scanline, dot, register, value), see register_access. Visible lines are
+        # drawn lazily, in runs between accesses, up to self._rendered.
+        self.register_log = []
+        self._rendered = 0
+
+        # Set by start_worker to draw frames in another process. This PPU then only draws what it needs for the
+        # status flags.
+        self.worker = None
+        self.draw = True
+
+        self.evaluate_sprites()
+        console.Cart.mapper.add_chr_listener(self.chr_switched)
+        console.Cart.mapper.add_mirroring_listener(self.set_mirroring)
+
+    def start_worker(self):
+        from renderworker import RenderWorker
+        # The frame under way is still drawn here, the worker takes over from the next one.
+        self.worker = RenderWorker(self)
 
-        super(PPU, self).__init__()
+    def stop_worker(self):
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+            self.draw = True
 
     def update_control_1(self, value):
         log.debug('PPU: Updating control register 1 to {0:b}'.format(value))
+        self.control_1 = value
         self.temp_vram_addr &= 0xf3ff
         self.temp_vram_addr |= (value & 0x3) << 10
 
@@ -207,21 +373,59 @@ class PPU(threading.Thread):
             self.sprite_size = 8
 
         if value & (1 << 7):
+            # Enabling NMI during vblank raises one straight away.
+            if not self.NMI and self._vblank:
+                self._console.CPU.assert_interrupt(self._console.CPU.NMI)
             self.NMI = True
         else:
             self.NMI = False
 
     def update_control_2(self, value):
         log.debug('PPU: Updating control register 2 to {0:b}'.format(value))
+        self.control_2 = value
         self.color = not bool(value & 1)
         self.bg_clipping = bool(value & (1 << 1))
         self.sprite_clipping = bool(value & (1 << 2))
         self.show_background = bool(value & (1 << 3))
         self.show_sprites = bool(value & (1 << 4))
+        self.color_intensity = value >> 5
 
     def status_register(self):
+        scanline, dot = self.timestamp()
+        return self.register_access(scanline, dot, 2, None)
+
+    def write_register(self, register, value):
+        scanline, dot = self.timestamp()
+        self.register_access(scanline, dot, register, value)
+
+    def register_access(self, scanline, dot, register, value):
+        """
+        Log a CPU access to $2000 + register at the given scanline and dot, then apply it. A value of None is a read
+        of the status register, which is returned. Lines up to and including the current one are drawn with the
+        state from before the access, which also brings sprite 0 hit and overflow up to date for status reads.
+        """
+        self.register_log.append((scanline, dot, register, value))
+        if scanline < 240:
+            self.render_lines(scanline + 1)
+
+        if value is None:
+            return self._read_status()
+        elif register == 0:
+            self.update_control_1(value)
+        elif register == 1:
+            self.update_control_2(value)
+        elif register == 3:
+            self.spr_ram_addr = value
+        elif register == 4:
+            self.write_sprram(value)
+        elif register in (5, 6, 7):
+            self.reg_write(register + 0x2000, value)
+        else:
+            log.debug("Unhandled I/O register write: {0:#06x}".format(register + 0x2000))
+
+    def _read_status(self):
         value = int(self.accept_vram_writes) << 4
-        value |= (int(self.scanline_sprite_count > 8) << 5)
+        value |= (int(self.sprite_overflow) << 5)
         value |= (int(self.sprite_0_hit) << 6)
         value |= (int(self._vblank) << 7)
 
@@ -234,9 +438,9 @@ class PPU(threading.Thread):
     def enter_vblank(self):
         log.debug("**** VBLANK ****")
 
-        # If the NMI bit is set, generate an NMI IRQ
+        # If the NMI bit is set, signal an NMI
         if self.NMI:
-            self._console.CPU.IRQ.value = b'N'
+            self._console.CPU.assert_interrupt(self._console.CPU.NMI)
 
         self._vblank = True
         self.vblank = True
@@ -244,20 +448,27 @@ class PPU(threading.Thread):
     def exit_vblank(self):
         self._vblank = False
         self.vblank = False
+        # Sprite flags are cleared at the start of the pre-render line too.
+        self.sprite_0_hit = False
+        self.sprite_overflow = False
 
     def write_sprram(self, value):
-        self._sprite_ram[self.spr_ram_addr] = value
-        self.spr_ram_addr += 1
+        self._oam_bytes[self.spr_ram_addr] = value
+        self.spr_ram_addr = (self.spr_ram_addr + 1) & 0xff
 
     def read_sprram(self):
-        return self._sprite_ram[self.spr_ram_addr]
+        return int(self._oam_bytes[self.spr_ram_addr])
 
     def dma_sprram(self, vals):
         if len(vals) != 256:
             log.critical("Invalid DMA write of {0} bytes.".format(len(vals)))
             raise Exception()
 
-        self._sprite_ram = vals
+        # Like $2004 writes, DMA starts at the current OAM address and wraps around.
+        start = self.spr_ram_addr
+        vals = np.frombuffer(vals, dtype=np.uint8)
+        self._oam_bytes[start:] = vals[:0x100 - start]
+        self._oam_bytes[:start] = vals[0x100 - start:]
 
     def reg_write(self, reg, value):
         if reg == 0x2005:
@@ -283,25 +494,282 @@ class PPU(threading.Thread):
 
         elif reg == 0x2007:
             self.memory.write(self.vram_addr, value)
-            self.vram_addr += self.address_increment
+            self.vram_addr = (self.vram_addr + self.address_increment) & 0x7fff
 
 
     def generate_frame(self):
         log.debug("PPU: Generating new frame...")
-        self.sprites_to_draw = []
-        self.frame = pyglet.graphics.Batch()
-        #background_color = list(self._palette[self.memory._ram[0x3f00]])
-        background_color = [255, 255, 255]
-        background_palette = [self._palette[x] for x in self.memory._ram[0x3f01:0x3f10]]
-        sprite_palette = [self._palette[x] for x in self.memory._ram[0x3f11:0x3f20]]
-
-        background = pyglet.image.ImageData(512, 448, "RGB", bytes(background_color * 512 * 448))
-        self.sprites_to_draw.append(pyglet.sprite.Sprite(background, batch=self.frame))
-
-    def run(self):
-        while True:
-            self._console.CPU.EndOfCycle.wait()
-            self._console.CPU.EndOfCycle.clear()
-            self.starting_scanline = int(self._console.CPU.Cycles.value / 113.33)
-            self.generate_frame()
+        # Sprites leave the picture different from the background even when they have since gone.
+        changed = self._picture_changed or self._sprites_drawn or self._sprites_drawn_before
+        self._picture_changed = False
+        self._sprites_drawn_before = self._sprites_drawn
+        self._sprites_drawn = False
+        key = (self.memory.palette_version, self.color, self.color_intensity)
+        if not changed and key == self._rgb_key:
+            return
+        self._rgb_key = key
+
+        np.take(self._palette_ram, self.picture, out=self._colors)
+        if not self.color:
+            # Greyscale keeps only the brightness column of the palette.
+            self._colors &= 0x30
+        np.take(self._palette_lut[self.color_intensity], self._colors, axis=0, out=self.rgb)
+
+    def chr_switched(self, start, end):
+        """
+        The mapper switched the CHR at PPU addresses [start, end). Lines so far are drawn with the old CHR.
+        """
+        self.draw_to_now()
+        self.memory.chr_switched(start, end)
+
+    def set_mirroring(self, layout):
+        """
+        The mapper switched the nametable layout. Lines so far are drawn with the old one.
+        """
+        self.draw_to_now()
+        self.memory.set_mirroring(layout)
+        # The same scroll position now reads other physical nametables.
+        self._background_keys = [None] * 240
+
+    def draw_to_now(self):
+        """
+        Draw the visible lines up to and including the one the CPU has reached.
+        """
+        scanline, dot = self.timestamp()
+        if scanline < 240:
+            self.render_lines(scanline + 1)
+
+    def timestamp(self):
+        """
+        The scanline and dot the CPU has reached, from the scheduler's master clock.
+        """
+        dots = self._console.scheduler.clock * DOTS_PER_CPU_CYCLE - self.scanline_start
+        return (self.scanline + dots // DOTS_PER_SCANLINE) % SCANLINES_PER_FRAME, dots % DOTS_PER_SCANLINE
+
+    def render_lines(self, end):
+        """
+        Draw the visible lines from the first one not yet drawn up to (not including) `end`. No register has been
+        written since the last call, so they all share one state and are drawn as a single block.
+        """
+        start = self._rendered
+        end = min(end, 240)
+        if start >= end:
+            return
+        self._rendered = end
+        if self.memory.stale_tiles:
+            self.memory.decode_tiles()
+
+        if self.show_background or self.show_sprites:
+            # vram_addr at the start of each line, leaving it at the start of line `end`.
+            addresses = []
+            for _ in range(start, end):
+                addresses.append(self.vram_addr)
+                self._next_line()
+
+        lines = range(start, end) if self.draw else self._sprite_0_lines(start, end)
+        if self.show_background:
+            redraw = []
+            for line in lines:
+                key = self._background_key(addresses[line - start])
+                if key != self._background_keys[line]:
+                    self._background_keys[line] = key
+                    redraw.append(line)
+            if redraw:
+                self._render_background(redraw, [addresses[line - start] for line in redraw])
+                self._picture_changed = True
+        elif any(key is not None for key in self._background_keys[start:end]):
+            self.background[start:end] = 0
+            self._background_keys[start:end] = [None] * (end - start)
+            self._picture_changed = True
+
+        self.picture[start:end] = self.background[start:end]
+        if self.show_sprites:
+            if max(self._sprite_counts[start:end]) > 8:
+                self.sprite_overflow = True
+            self.scanline_sprite_count = self._sprite_counts[end - 1]
+            if len(lines):
+                self._render_sprites(np.asarray(lines, dtype=np.intp))
+
+    def _sprite_0_lines(self, start, end):
+        """
+        The lines in [start, end) that could still produce a sprite 0 hit this frame.
+        """
+        if self.sprite_0_hit or not (self.show_background and self.show_sprites):
+            return []
+        return (start + np.flatnonzero(self._sprite_lines[start:end, 0])).tolist()
+
+    def _background_key(self, v):
+        """
+        Everything a background line starting at vram address v depends on: the scroll position, the pattern table,
+        clipping, and the versions of the nametable rows and CHR it reads.
+        """
+        table = (v >> 10) & 0x3
+        row = (v >> 5) & 0x1f
+        left = (self.memory.pages[table] << 5) | row
+        right = (self.memory.pages[table ^ 1] << 5) | row
+        versions = self.memory.row_versions
+        return (v, self.fine_x, self.background_pattern_table, self.bg_clipping, left, right, versions[left],
+                versions[right], self.memory.chr_version)
+
+    def _render_background(self, lines, addresses):
+        """
+        Draw the background of the given lines, each starting at the matching vram address, with the current fine_x.
+        """
+        v = np.array(addresses, dtype=np.intp)
+        coarse_y = ((v >> 5) & 0x1f)[:, None]
+        fine_y = ((v >> 12) & 0x7)[:, None]
+
+        # Each line fetches 33 tiles. Those past column 31 come from the horizontally adjacent nametable.
+        columns = (v & 0x1f)[:, None] + TILE_COLUMNS
+        tables = ((v >> 10) & 0x3)[:, None] ^ ((columns >> 5) & 0x1)
+        columns &= 0x1f
+        bases = self.memory.nametable_bases[tables]
+
+        tiles = self._vram[bases + (coarse_y << 5) + columns]
+        attributes = self._vram[bases + 0x3c0 + ((coarse_y >> 2) << 3) + (columns >> 2)]
+        palettes = (attributes >> (((coarse_y & 0x2) << 1) | (columns & 0x2))) & 0x3
+
+        pixels = self.memory.tiles[(self.background_pattern_table >> 4) + tiles.astype(np.intp), fine_y]
+
+        # Colour 0 of every palette shows the backdrop at $3f00.
+        colors = np.where(pixels, (palettes[:, :, None] << 2) | pixels, 0).reshape(len(lines), 33 * 8)
+        rows = colors[:, self.fine_x:self.fine_x + 256]
+        if not self.bg_clipping:
+            rows[:, :8] = 0
+        self.background[lines] = rows
+
+    def evaluate_sprites(self):
+        """
+        Work out which sprites are on each scanline of the coming frame from the current OAM.
+        """
+        top = self.oam[:, 0].astype(np.intp) + 1
+        lines = np.arange(240)[:, None]
+        in_range = (lines >= top) & (lines < top + self.sprite_size)
+        self._sprite_counts = in_range.sum(axis=1).tolist()
+        # Only the first eight sprites in OAM order are drawn on a line.
+        self._sprite_lines = in_range & (np.cumsum(in_range, axis=1) <= 8)
+        # Those eight as OAM indices per line, front to back, and which of the eight slots are used.
+        self._sprite_slots = np.argsort(~self._sprite_lines, axis=1, kind='stable')[:, :8]
+        self._sprite_slot_used = np.take_along_axis(self._sprite_lines, self._sprite_slots, axis=1)
+
+    def _render_sprites(self, lines):
+        """
+        Composite the sprites on the given lines over the picture, and check for a sprite 0 hit.
+        """
+        used = self._sprite_slot_used[lines]
+        # Only lines with sprites, and only as many slots as the busiest of them uses.
+        slots = int(used.sum(axis=1).max())
+        if not slots:
+            return
+        self._sprites_drawn = True
+        lines = lines[used[:, 0]]
+        used = self._sprite_slot_used[lines, :slots]
+
+        # Everything below is per line, per slot: oam[line, slot, byte].
+        sprites = self._sprite_slots[lines, :slots]
+        oam = self.oam[sprites]
+        attributes = oam[:, :, 2]
+        rows = np.where(used, lines[:, None] - 1 - oam[:, :, 0].astype(np.intp), 0)
+        rows = np.where(attributes & 0x80, self.sprite_size - 1 - rows, rows)
+        if self.sprite_size == 16:
+            # 8x16 sprites pick their pattern table with bit 0 of the tile number.
+            tiles = ((oam[:, :, 1] & 0x1).astype(np.intp) << 8) + (oam[:, :, 1] & 0xfe) + (rows >> 3)
+            rows &= 0x7
+        else:
+            tiles = (self.sprite_pattern_table >> 4) + oam[:, :, 1].astype(np.intp)
+        pixels = self.memory.tiles[tiles, rows]
+        pixels = np.where((attributes & 0x40)[:, :, None] != 0, pixels[:, :, ::-1], pixels)
+        opaque = (pixels != 0) & used[:, :, None]
+        colors = 0x10 | ((attributes[:, :, None] & 0x3) << 2) | pixels
+
+        # Spread each slot over a line 8 pixels wider than the screen, since sprites may hang off the right edge.
+        # Slots are in OAM order, so the front sprite at each pixel is the first slot opaque there.
+        columns = oam[:, :, 3, None].astype(np.intp) + np.arange(8)
+        covered = np.zeros((len(lines), slots, 256 + 8), dtype=bool)
+        np.put_along_axis(covered, columns, opaque, axis=2)
+        layer = np.zeros((len(lines), slots, 256 + 8), dtype=np.uint8)
+        np.put_along_axis(layer, columns, colors, axis=2)
+        front = covered.argmax(axis=1)[:, None, :256]
+        shown = covered.any(axis=1)[:, :256]
+        layer = np.take_along_axis(layer[:, :, :256], front, axis=1)[:, 0]
+        behind = np.take_along_axis(attributes & 0x20, front[:, 0], axis=1) != 0
+        if not self.sprite_clipping:
+            shown[:, :8] = False
+
+        picture = self.picture[lines]
+        background = (picture & 0x3) != 0
+        if not self.sprite_0_hit:
+            # Sprite 0 can only be in the front slot.
+            hits = covered[:, 0, :256] & (sprites[:, 0] == 0)[:, None] & used[:, 0, None] & background
+            # No hit at x = 255, or in the left 8 pixels while either layer is clipped there.
+            hits[:, 255] = False
+            if not (self.bg_clipping and self.sprite_clipping):
+                hits[:, :8] = False
+            self.sprite_0_hit = bool(hits.any())
+
+        self.picture[lines] = np.where(shown & ~(behind & background), layer, picture)
+
+    def _next_line(self):
+        """
+        Move vram_addr down one pixel row, then reload its horizontal position from temp_vram_addr.
+        """
+        v = self.vram_addr
+        if (v & 0x7000) != 0x7000:
+            v += 0x1000
+        else:
+            v &= ~0x7000
+            coarse_y = (v >> 5) & 0x1f
+            if coarse_y == 29:
+                # Bottom of the nametable, wrap into the one below.
+                coarse_y = 0
+                v ^= 0x0800
+            elif coarse_y == 31:
+                # Rows 30 and 31 hold attributes, wrap without switching nametables.
+                coarse_y = 0
+            else:
+                coarse_y += 1
+            v = (v & ~0x03e0) | (coarse_y << 5)
+        self.vram_addr = (v & ~0x041f) | (self.temp_vram_addr & 0x041f)
+
+    def next_scanline_cycle(self):
+        """
+        The CPU cycle at which the current scanline will have finished.
+        """
+        return -(-(self.scanline_start + DOTS_PER_SCANLINE) // DOTS_PER_CPU_CYCLE)
+
+    def catch_up(self, cpu_cycle):
+        """
+        Run every scanline that finishes by the given CPU cycle.
+        """
+        dots = cpu_cycle * DOTS_PER_CPU_CYCLE
+        while self.scanline_start + DOTS_PER_SCANLINE <= dots:
+            self.scanline_start += DOTS_PER_SCANLINE
+            self.end_scanline()
+
+    def end_scanline(self):
+        if self.scanline == 239:
+            self.render_lines(240)
+        elif self.scanline == SCANLINES_PER_FRAME - 1:
+            # The pre-render line reloads the whole scroll position and fetches the sprites for the next frame.
+            if self.show_background or self.show_sprites:
+                self.vram_addr = self.temp_vram_addr
+            self.evaluate_sprites()
+            self._rendered = 0
+            self.register_log = []
+            if self.worker is not None:
+                self.worker.frame_started(self)
+                self.draw = False
+
+        self.scanline += 1
+        if self.scanline == 241:
+            # The visible picture is complete.
+            if self.worker is None or not self.worker.frame_finished(self):
+                self.generate_frame()
+            self.frame_count += 1
+            self.enter_vblank()
+        elif self.scanline == SCANLINES_PER_FRAME - 1:
+            # Pre-render line
+            self.exit_vblank()
+        elif self.scanline == SCANLINES_PER_FRAME:
+            self.scanline = 0
 
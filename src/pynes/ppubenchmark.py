@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+PyNES - PPU replay benchmark
+
+`record` runs a ROM and saves every CPU to PPU interaction with its CPU cycle: register writes, status reads, sprite
+DMA and mapper CHR and mirroring switches. `replay` feeds such a file to a PPU on its own, with no CPU or cartridge,
+and reports frames per second, the time spent in each rendering stage and a hash of every frame drawn. The hash
+printed by `record` is that of the live run, so the two can be compared.
+"""
+
+import argparse
+import hashlib
+import logging
+import struct
+import time
+import numpy as np
+from cartridge import Cartridge
+from console import Console
+from ppu import PPU
+from renderworker import LAYOUTS, replay_console
+
+MAGIC = b"PYNESPPU"
+VERSION = 3
+
+# Magic, version, nametable layout, whether CHR is RAM, event count, payload size and the CPU cycle the recording
+# ends at. The CHR contents at power on follow, then the events, then the payload.
+HEADER = struct.Struct("<8sHBBIIQ")
+
+# A write of value to $2000 + register, a read of $2002, a sprite DMA whose 256 bytes are in the payload, a mapper
+# CHR switch of PPU addresses [register << 10, value << 10) whose new contents are in the payload, and a mapper switch
+# to nametable layout LAYOUTS[value].
+WRITE = 0
+READ = 1
+DMA = 2
+CHR = 3
+MIRRORING = 4
+
+EVENT = np.dtype([('cycle', '<u8'), ('kind', 'u1'), ('register', 'u1'), ('value', 'u1')])
+
+# The methods timed by replay, in the order they are reported. Tile decoding is part of render_lines.
+STAGES = ('render_lines', 'evaluate_sprites', 'generate_frame')
+
+
+class Recorder:
+    """
+    Log the CPU to PPU traffic of a console by wrapping the PPU entry points the CPU calls.
+    """
+    def __init__(self, console):
+        self._console = console
+        ppu = console.PPU
+        self.layout = ppu.memory.layout
+        self.chr = bytes(ppu.memory.chr)
+        self.chr_ram = ppu.memory.chr_ram
+        self.events = []
+        self.payload = bytearray()
+
+        write_register = ppu.write_register
+        status_register = ppu.status_register
+        dma_sprram = ppu.dma_sprram
+
+        def recorded_write(register, value):
+            self.events.append((self._console.scheduler.clock, WRITE, register, value))
+            write_register(register, value)
+
+        def recorded_read():
+            self.events.append((self._console.scheduler.clock, READ, 2, 0))
+            return status_register()
+
+        def recorded_dma(vals):
+            self.events.append((self._console.scheduler.clock, DMA, 0, 0))
+            self.payload += vals
+            dma_sprram(vals)
+
+        ppu.write_register = recorded_write
+        ppu.status_register = recorded_read
+        ppu.dma_sprram = recorded_dma
+        # Registered after the PPU's own listener, so the CHR seen here is already the new one.
+        console.Cart.mapper.add_chr_listener(self._chr_switched)
+        console.Cart.mapper.add_mirroring_listener(self._mirroring_switched)
+
+    def _chr_switched(self, start, end):
+        self.events.append((self._console.scheduler.clock, CHR, start >> 10, end >> 10))
+        self.payload += self._console.PPU.memory.chr[start:end]
+
+    def _mirroring_switched(self, layout):
+        self.events.append((self._console.scheduler.clock, MIRRORING, 0, LAYOUTS.index(layout)))
+
+    def save(self, filename):
+        events = np.array(self.events, dtype=EVENT)
+        with open(filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, LAYOUTS.index(self.layout), self.chr_ram, len(events),
+                                len(self.payload), self._console.scheduler.clock))
+            f.write(self.chr)
+            f.write(events.tobytes())
+            f.write(self.payload)
+
+
+def load(filename):
+    """
+    Read a recording. Returns the layout, the CHR at power on, whether it is RAM, the events, the payload and the
+    final CPU cycle.
+    """
+    with open(filename, 'rb') as f:
+        magic, version, layout, chr_ram, count, size, end = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise Exception("{0} is not a version {1} PPU recording".format(filename, VERSION))
+        chr = f.read(0x2000)
+        events = np.frombuffer(f.read(count * EVENT.itemsize), dtype=EVENT)
+        payload = memoryview(f.read(size))
+    return LAYOUTS[layout], chr, bool(chr_ram), events, payload, end
+
+
+def frame_hasher(ppu):
+    """
+    Wrap ppu.generate_frame to hash the picture of every frame. Returns the hash object.
+    """
+    digest = hashlib.sha1()
+    generate_frame = ppu.generate_frame
+
+    def hashed_generate_frame():
+        generate_frame()
+        digest.update(ppu.rgb)
+    ppu.generate_frame = hashed_generate_frame
+    return digest
+
+
+def stage_timer(ppu):
+    """
+    Wrap the STAGES methods of ppu to add up the time spent in each. Returns the dict of totals.
+    """
+    totals = dict.fromkeys(STAGES, 0.0)
+    for stage in STAGES:
+        method = getattr(ppu, stage)
+
+        def timed(*args, stage=stage, method=method):
+            start = time.perf_counter()
+            result = method(*args)
+            totals[stage] += time.perf_counter() - start
+            return result
+        setattr(ppu, stage, timed)
+    return totals
+
+
+def replay(filename):
+    """
+    Drive a standalone PPU through a recording. Returns the frames drawn, the seconds taken, the seconds per stage
+    and the frame hash.
+    """
+    layout, chr, chr_ram, events, payload, end = load(filename)
+    console = replay_console()
+    ppu = PPU(console)
+    ppu.memory.set_mirroring(layout)
+    ppu.memory.chr[:] = chr
+    ppu.memory.chr_ram = chr_ram
+    ppu.memory.chr_switched(0, 0x2000)
+    totals = stage_timer(ppu)
+    digest = frame_hasher(ppu)
+    scheduler = console.scheduler
+
+    offset = 0
+    start = time.perf_counter()
+    for cycle, kind, register, value in events.tolist():
+        ppu.catch_up(cycle)
+        scheduler.clock = cycle
+        if kind == WRITE:
+            ppu.write_register(register, value)
+        elif kind == READ:
+            ppu.status_register()
+        elif kind == DMA:
+            ppu.dma_sprram(payload[offset:offset + 0x100])
+            offset += 0x100
+        elif kind == CHR:
+            # As PPU.chr_switched does, but with the new CHR from the payload rather than a mapper.
+            size = (value - register) << 10
+            ppu.draw_to_now()
+            ppu.memory.chr[register << 10:value << 10] = payload[offset:offset + size]
+            ppu.memory.chr_switched(register << 10, value << 10)
+            offset += size
+        else:
+            ppu.set_mirroring(LAYOUTS[value])
+    ppu.catch_up(end)
+    seconds = time.perf_counter() - start
+    return ppu.frame_count, seconds, totals, digest.hexdigest()
+
+
+def record(romfile, filename, frames):
+    """
+    Run a ROM for the given number of frames, saving its PPU traffic. Returns the frame hash of the live run.
+    """
+    console = Console(Cartridge(romfile))
+    recorder = Recorder(console)
+    digest = frame_hasher(console.PPU)
+    console.run_frames(frames)
+    recorder.save(filename)
+    return len(recorder.events), digest.hexdigest()
+
+
+def main():
+    logging.getLogger("PyNES").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description="Record and replay PPU traffic to benchmark the PyNES renderer")
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record', help="Run a ROM and save its PPU traffic")
+    record_parser.add_argument('romfile', metavar="filename", type=str, help="The ROM file to run")
+    record_parser.add_argument('output', type=str, help="The recording to write")
+    record_parser.add_argument('--frames', type=int, default=600, help="Number of frames to record")
+    replay_parser = commands.add_parser('replay', help="Replay saved PPU traffic and time the renderer")
+    replay_parser.add_argument('recording', type=str, help="The recording to replay")
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        count, frame_hash = record(args.romfile, args.output, args.frames)
+        print("{0} events in {1}, frame hash {2}".format(count, args.output, frame_hash))
+        return
+
+    frames, seconds, totals, frame_hash = replay(args.recording)
+    if not frames:
+        print("No frame drawn in {0:.2f}s: the recording ends before the first frame completes".format(seconds))
+    else:
+        print("{0} frames in {1:.2f}s: {2:.2f} frames/sec".format(frames, seconds, frames / seconds))
+        for stage in STAGES:
+            print("{0:>18}: {1:8.3f} ms/frame".format(stage, totals[stage] * 1000 / frames))
+        print("{0:>18}: {1:8.3f} ms/frame".format('other', (seconds - sum(totals.values())) * 1000 / frames))
+    print("frame hash {0}".format(frame_hash))
+
+
+if __name__ == "__main__":
+    main()
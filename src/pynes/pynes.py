@@ -5,9 +5,10 @@ PyNES - A Nintendo Entertainment System emulator written in Python
 
 import argparse
 import logging
-import pyglet
 from cartridge import Cartridge
 from console import Console
+from cpu.blocks import BlockCache
+from pacing import FramePacer
 from utils import ColorFormatter
 
 __author__ = "Misha Kononov"
@@ -23,11 +24,28 @@ window = None
 console = None
 log = None
 
+# The PPU's RGB buffer as pyglet image data, the texture it is uploaded into, the visible part of that texture,
+# and the frame_count of the frame on screen.
+picture_data = None
+picture = None
+texture = None
+screen = None
+shown_frame = None
+
+# Plays the APU output, when sound is on.
+player = None
+# Decides when to emulate frames.
+pacer = None
+# Writes the APU output to a file, with --capture.
+capture = None
+
 
 def init():
     global window
     global console
     global log
+    global pacer
+    global capture
     FORMAT = "[$BOLD%(name)s$RESET][%(levelname)-8s]  $COLOR%(message)s$RESET ($BOLD%(filename)s$RESET:%(lineno)d)"
     shandler = logging.StreamHandler()
     shandler.setFormatter(ColorFormatter(FORMAT))
@@ -37,23 +55,154 @@ def init():
 
     parser = argparse.ArgumentParser(description="Parse command line options for PyNES")
     parser.add_argument('romfile', metavar="filename", type=str, help="The ROM file to load")
+    parser.add_argument('--headless', action='store_true', help="Run without a display, as fast as possible")
+    parser.add_argument('--pace', action='store_true', help="In headless mode, run at the NES frame rate")
+    parser.add_argument('--max-catch-up', type=int, default=4,
+                        help="Most frames to run back to back after falling behind, before skipping ahead")
+    parser.add_argument('--frames', type=int, default=600, help="Number of frames to run in headless mode")
+    parser.add_argument('--blocks', action='store_true', help="Run PRG ROM code through the block translation cache")
+    parser.add_argument('--audio', action='store_true', help="Play sound")
+    parser.add_argument('--capture', type=str, help="Write the sound to a WAV file (or raw PCM for other names)")
+    parser.add_argument('--audio-hashes', type=str, help="With --capture, write a hash of each frame's sound here")
+    parser.add_argument('--render-worker', action='store_true',
+                        help="Draw frames in a separate process, one frame behind emulation")
     args = parser.parse_args()
 
     cartridge = Cartridge(args.romfile)
     console = Console(cartridge)
-    console.boot()
+    if args.blocks:
+        console.CPU.blocks = BlockCache(console.CPU)
+    if args.headless:
+        # Debug logging would dominate an unthrottled run, here and in a render worker.
+        log.setLevel(logging.WARNING)
+    if args.render_worker:
+        console.PPU.start_worker()
+
+    if args.capture:
+        from audio import AudioCapture
+        capture = AudioCapture(console.APU, args.capture, hashes=args.audio_hashes)
 
-    window = pyglet.window.Window(visible=False)
+    if args.headless:
+        if args.pace:
+            pacer = FramePacer(console, max_catch_up=args.max_catch_up)
+            run_paced(args.frames)
+        else:
+            run_headless(args.frames)
+        console.close()
+        close_capture()
+        return False
+
+    import pyglet
+    window = pyglet.window.Window(visible=False, resizable=True)
     window.set_size(512, 448)
     window.on_draw = on_draw
+    init_display()
+    # With sound on, emulation follows the audio device, so it neither starves nor overfills the playback buffer.
+    pacer = FramePacer(console, audio=init_audio() if args.audio else None, max_catch_up=args.max_catch_up)
+    pyglet.clock.schedule_interval(run_frames, 1 / 240.0)
     window.set_visible(True)
+    return True
+
+
+def init_display():
+    """
+    Create the one texture the PPU picture is uploaded into. The picture wraps the PPU's RGB buffer without copying
+    it, and the texture is scaled to the window with nearest filtering.
+    """
+    global picture_data
+    global picture
+    global texture
+    global screen
+    import ctypes
+    import pyglet
+    from pyglet import gl
+
+    rgb = console.PPU.rgb
+    picture_data = (ctypes.c_ubyte * rgb.nbytes).from_buffer(rgb)
+    picture = pyglet.image.ImageData(256, 240, "RGB", picture_data, pitch=-256 * 3)
+
+    texture = pyglet.image.Texture.create(256, 240)
+    gl.glBindTexture(texture.target, texture.id)
+    gl.glTexParameteri(texture.target, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+    gl.glTexParameteri(texture.target, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+    # The top and bottom 8 lines are not visible on an NTSC television.
+    screen = texture.get_region(0, 8, 256, 224)
+
+
+def init_audio():
+    """
+    Play the APU output through a streaming pyglet source. pyglet's audio thread drains the ring buffer the
+    emulator fills, and neither waits on the other.
+    """
+    global player
+    import pyglet
+    from pyglet.media.codecs.base import AudioData, AudioFormat, Source
+    from audio import AudioOutput
+
+    output = AudioOutput(console.APU)
+
+    class RingSource(Source):
+        def __init__(self):
+            self.audio_format = AudioFormat(channels=1, sample_size=16, sample_rate=output.rate)
+            self.video_format = None
+
+        def get_audio_data(self, num_bytes, compensation_time=0.0):
+            count = num_bytes // 2
+            data = output.read(count).tobytes()
+            return AudioData(data, len(data), 0.0, count / output.rate, [])
+
+    player = pyglet.media.Player()
+    player.queue(RingSource())
+    player.play()
+    return output
+
+
+def close_capture():
+    """
+    Write out the rest of the captured sound, if any, and print its hash.
+    """
+    if capture is not None:
+        capture.close()
+        print("sound hash {0}".format(capture.digest.hexdigest()))
+
+
+def run_headless(frames):
+    seconds, cycles = console.run_frames(frames)
+    if not frames:
+        print("No frames run")
+        return
+    print("{0} frames in {1:.2f}s: {2:.2f} frames/sec, {3:.3f} MHz emulated CPU".format(
+        frames, seconds, frames / seconds, cycles / seconds / 1e6))
+
+
+def run_paced(frames):
+    while pacer.frames < frames:
+        pacer.wait()
+        for _ in range(min(pacer.due(), frames - pacer.frames)):
+            pacer.run_frame()
+    print(pacer.report())
+
+
+def run_frames(dt):
+    pacer.tick()
 
 
 def on_draw():
-    log.debug("APP: ON_DRAW")
+    global shown_frame
+    # Upload only when emulation has finished a new frame. Until then the last one is shown again, and if several
+    # finished since the last draw only the newest is shown.
+    if console.PPU.frame_count != shown_frame:
+        picture.set_data("RGB", -256 * 3, picture_data)
+        texture.blit_into(picture, 0, 0, 0)
+        shown_frame = console.PPU.frame_count
+
     window.clear()
-    console.PPU.frame.draw()
+    screen.blit(0, 0, width=window.width, height=window.height)
 
 if __name__ == "__main__":
-    init()
-    pyglet.app.run()
+    if init():
+        import pyglet
+        pyglet.app.run()
+        console.close()
+        close_capture()
+        print(pacer.report())
@@ -0,0 +1,272 @@
+"""
+PyNES - Parallel frame rendering
+
+A frame is fully described by the PPU memory and render state at the end of the pre-render line plus the register
+accesses and mapper CHR and mirroring switches made during it. RenderWorker copies that record into shared memory and
+has a separate process draw it, so the picture for frame N is drawn while the CPU emulates frame N+1. A frame whose
+log does not fit in a record is drawn in this process instead.
+"""
+
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+import numpy as np
+from ppu import PPU, NAMETABLE_LAYOUTS
+
+__author__ = 'misha'
+
+log = logging.getLogger("PyNES")
+
+LAYOUTS = list(NAMETABLE_LAYOUTS)
+
+# Log entries and bytes of switched CHR a record has room for.
+MAX_LOG = 0x4000
+MAX_PAYLOAD = 0x10000
+
+# Log entries past the eight registers: a mapper CHR switch of PPU addresses [(value >> 8) << 10, (value & 0xff) << 10)
+# whose new contents are next in the payload, and a mapper switch to nametable layout LAYOUTS[value]. In
+# PPU.register_log the value of a CHR switch is (start, end, contents).
+CHR = 8
+MIRRORING = 9
+
+# header holds the nametable layout, the log length, the render state ($2000, $2001, vram_addr, temp_vram_addr,
+# fine_x and the $2005/$2006 write toggle) and whether CHR is RAM. Log entries are (scanline, dot, register, value), with a
+# value of -1 for status reads.
+RECORD = np.dtype([
+    ('header', '<i4', 9),
+    ('vram', 'u1', 0x1000),
+    ('chr', 'u1', 0x2000),
+    ('palette', 'u1', 0x20),
+    ('oam', 'u1', (64, 4)),
+    ('log', '<i4', (MAX_LOG, 4)),
+    ('payload', 'u1', MAX_PAYLOAD),
+    ('rgb', 'u1', (240, 256, 3)),
+])
+
+
+def record_views(records, slot):
+    """
+    Views of each field of one record in an array of RECORD.
+    """
+    return SimpleNamespace(**{name: records[name][slot] for name in RECORD.names})
+
+
+def capture_state(ppu, record):
+    """
+    Copy what a frame is drawn from into a record. Called at the end of the pre-render line.
+    """
+    memory = ppu.memory
+    record.header[0] = LAYOUTS.index(memory.layout)
+    record.header[2:8] = (ppu.control_1, ppu.control_2, ppu.vram_addr, ppu.temp_vram_addr, ppu.fine_x,
+                          ppu.reg_write_toggle)
+    record.header[8] = memory.chr_ram
+    record.vram[:len(memory.vram)] = np.frombuffer(memory.vram, dtype=np.uint8)
+    record.chr[:] = np.frombuffer(memory.chr, dtype=np.uint8)
+    record.palette[:] = np.frombuffer(memory.palette, dtype=np.uint8)
+    record.oam[:] = ppu.oam
+
+
+def capture_log(ppu, record):
+    """
+    Copy the register accesses and mapper switches of the frame just finished into a record. Returns False if they
+    do not fit, leaving the record incomplete.
+    """
+    accesses = ppu.register_log
+    if len(accesses) > MAX_LOG:
+        return False
+    entries = []
+    payload = bytearray()
+    for scanline, dot, register, value in accesses:
+        if register == CHR:
+            start, end, contents = value
+            value = (start >> 10) << 8 | end >> 10
+            payload += contents
+        elif value is None:
+            value = -1
+        entries.append((scanline, dot, register, value))
+    if len(payload) > MAX_PAYLOAD:
+        return False
+    record.header[1] = len(entries)
+    if entries:
+        record.log[:len(entries)] = entries
+    record.payload[:len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+    return True
+
+
+def record_log(record):
+    """
+    The log of a record in the form of PPU.register_log.
+    """
+    accesses = []
+    offset = 0
+    for scanline, dot, register, value in record.log[:record.header[1]].tolist():
+        if register == CHR:
+            start, end = (value >> 8) << 10, (value & 0xff) << 10
+            value = (start, end, record.payload[offset:offset + end - start].tobytes())
+            offset += end - start
+        elif value < 0:
+            value = None
+        accesses.append((scanline, dot, register, value))
+    return accesses
+
+
+def replay_console():
+    """
+    Just enough of a Console to build a PPU that is driven only by records: no cartridge, CPU or scheduler.
+    """
+    mapper = SimpleNamespace(chr_banks=[None] * 8, layout=None, add_chr_listener=lambda listener: None,
+                             add_mirroring_listener=lambda listener: None)
+    cart = SimpleNamespace(four_screen=True, vertical_mirroring=False, chr_rom=b'', mapper=mapper)
+    cpu = SimpleNamespace(NMI=0, assert_interrupt=lambda line: None)
+    return SimpleNamespace(Cart=cart, CPU=cpu, scheduler=SimpleNamespace(clock=0))
+
+
+def switch_mirroring(ppu, layout):
+    """
+    As PPU.set_mirroring, for a PPU with no scheduler to tell the time by. The caller draws the lines before.
+    """
+    if layout != ppu.memory.layout:
+        ppu.memory.set_mirroring(layout)
+        ppu._background_keys = [None] * 240
+
+
+def replay(ppu, record, accesses):
+    """
+    Draw a frame on a PPU built from replay_console, from the state in a record and the accesses logged during it in
+    the form of PPU.register_log. The picture ends up in ppu.rgb.
+    """
+    memory = ppu.memory
+    switch_mirroring(ppu, LAYOUTS[record.header[0]])
+    memory.load(record.vram, record.chr, record.palette)
+    memory.chr_ram = bool(record.header[8])
+    ppu.oam[:] = record.oam
+
+    control_1, control_2, vram_addr, temp_vram_addr, fine_x, toggle = record.header[2:8].tolist()
+    ppu.update_control_1(control_1)
+    ppu.update_control_2(control_2)
+    ppu.vram_addr = vram_addr
+    ppu.temp_vram_addr = temp_vram_addr
+    ppu.fine_x = fine_x
+    ppu.reg_write_toggle = bool(toggle)
+    ppu.sprite_0_hit = False
+    ppu.sprite_overflow = False
+    ppu.evaluate_sprites()
+    ppu._rendered = 0
+    ppu.register_log = []
+
+    # Accesses made during vblank only set up the next frame, whose record already includes their effect.
+    for scanline, dot, register, value in accesses:
+        if scanline >= 240:
+            break
+        if register == CHR:
+            # As PPU.chr_switched does, but with the new CHR from the log rather than a mapper.
+            start, end, contents = value
+            ppu.render_lines(scanline + 1)
+            memory.chr[start:end] = contents
+            memory.chr_switched(start, end)
+        elif register == MIRRORING:
+            ppu.render_lines(scanline + 1)
+            switch_mirroring(ppu, LAYOUTS[value])
+        else:
+            ppu.register_access(scanline, dot, register, value)
+    ppu.render_lines(240)
+    ppu.generate_frame()
+
+
+def serve(name, connection):
+    """
+    Worker process: draw each record whose slot arrives on the connection, until None arrives.
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    records = np.ndarray(2, dtype=RECORD, buffer=memory.buf)
+    slots = [record_views(records, slot) for slot in range(2)]
+    ppu = PPU(replay_console())
+    while True:
+        slot = connection.recv()
+        if slot is None:
+            break
+        replay(ppu, slots[slot], record_log(slots[slot]))
+        slots[slot].rgb[:] = ppu.rgb
+        connection.send(slot)
+
+    del slots
+    del records
+    memory.close()
+
+
+class RenderWorker:
+    def __init__(self, ppu):
+        self._ppu = ppu
+        self._memory = shared_memory.SharedMemory(create=True, size=RECORD.itemsize * 2)
+        self._records = np.ndarray(2, dtype=RECORD, buffer=self._memory.buf)
+        self._slots = [record_views(self._records, slot) for slot in range(2)]
+        self._connection, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=serve, args=(self._memory.name, child), daemon=True)
+        self._process.start()
+
+        # Slot being recorded, and slot whose picture is due next with whether the worker is still drawing it. Frames
+        # alternate between the two.
+        self._recording = None
+        self._drawing = None
+        self._in_worker = False
+        self._next = 0
+
+        # Draws the frames whose log does not fit in a record, built on first use.
+        self._fallback = None
+
+        # Registered after the PPU's own listeners, so the CHR seen here is already the new one.
+        ppu._console.Cart.mapper.add_chr_listener(self._chr_switched)
+        ppu._console.Cart.mapper.add_mirroring_listener(self._mirroring_switched)
+
+    def _chr_switched(self, start, end):
+        if self._ppu.worker is self:
+            scanline, dot = self._ppu.timestamp()
+            self._ppu.register_log.append((scanline, dot, CHR, (start, end, bytes(self._ppu.memory.chr[start:end]))))
+
+    def _mirroring_switched(self, layout):
+        if self._ppu.worker is self:
+            scanline, dot = self._ppu.timestamp()
+            self._ppu.register_log.append((scanline, dot, MIRRORING, LAYOUTS.index(layout)))
+
+    def frame_started(self, ppu):
+        self._recording = self._next
+        self._next ^= 1
+        capture_state(ppu, self._slots[self._recording])
+
+    def frame_finished(self, ppu):
+        """
+        Hand the frame just recorded to the worker, and put the one before it into ppu.rgb. Returns False if no frame
+        was recorded, as for the one the worker was started in, which the PPU then draws itself.
+        """
+        if self._recording is None:
+            return False
+        if self._drawing is not None:
+            self._collect(ppu)
+        record = self._slots[self._recording]
+        self._in_worker = capture_log(ppu, record)
+        if self._in_worker:
+            self._connection.send(self._recording)
+        else:
+            log.debug("PPU log of frame {0} does not fit in a record, drawing it here.".format(ppu.frame_count))
+            if self._fallback is None:
+                self._fallback = PPU(replay_console())
+            replay(self._fallback, record, ppu.register_log)
+            record.rgb[:] = self._fallback.rgb
+        self._drawing = self._recording
+        self._recording = None
+        return True
+
+    def _collect(self, ppu):
+        if self._in_worker:
+            self._connection.recv()
+        ppu.rgb[:] = self._slots[self._drawing].rgb
+        self._drawing = None
+
+    def close(self):
+        self._connection.send(None)
+        self._process.join()
+        del self._slots
+        del self._records
+        self._memory.close()
+        self._memory.unlink()
@@ -0,0 +1,64 @@
+"""
+PyNES - Single-threaded cycle scheduler
+
+The CPU runs on the calling thread against a plain-int master clock counted in CPU cycles. After each slice the PPU
+is caught up to the same timestamp, one whole scanline at a time, so a run is fully deterministic. The APU is only
+caught up when it has an event due (a frame counter step or DMC IRQ) and when a run ends, when its audio is flushed.
+"""
+
+import logging
+
+__author__ = 'misha'
+
+log = logging.getLogger("PyNES")
+
+# NTSC timing: three PPU dots per CPU cycle, 341 dots per scanline and 262 scanlines per frame.
+DOTS_PER_CPU_CYCLE = 3
+DOTS_PER_SCANLINE = 341
+SCANLINES_PER_FRAME = 262
+
+
+class Scheduler:
+    def __init__(self, console):
+        self._console = console
+        # CPU cycles since power on, as of the start of the instruction being executed. Kept up to date every step so
+        # devices can timestamp register accesses.
+        self.clock = 0
+        # The cycle the slice being run ends at. Translated blocks stop as soon as they reach it, where single steps
+        # would.
+        self.boundary = 0
+
+    def run_until(self, deadline):
+        """
+        Run the CPU until the master clock reaches `deadline`, catching the PPU up at every scanline boundary.
+        """
+        step = self._console.CPU.step
+        ppu = self._console.PPU
+        apu = self._console.APU
+        while self.clock < deadline:
+            boundary = self.boundary = min(ppu.next_scanline_cycle(), apu.next_event, deadline)
+            while self.clock < boundary:
+                self.clock += step()
+            ppu.catch_up(self.clock)
+            if self.clock >= apu.next_event:
+                apu.catch_up(self.clock)
+        apu.flush(self.clock)
+
+    def run_frame(self):
+        """
+        Run until the PPU finishes the frame in progress. Returns the CPU cycles emulated.
+        """
+        step = self._console.CPU.step
+        ppu = self._console.PPU
+        apu = self._console.APU
+        start = self.clock
+        frame = ppu.frame_count
+        while ppu.frame_count == frame:
+            boundary = self.boundary = min(ppu.next_scanline_cycle(), apu.next_event)
+            while self.clock < boundary:
+                self.clock += step()
+            ppu.catch_up(self.clock)
+            if self.clock >= apu.next_event:
+                apu.catch_up(self.clock)
+        apu.flush(self.clock)
+        return self.clock - start
@@ -0,0 +1,88 @@
+"""
+Builders for small iNES images to run tests against
+"""
+
+import os
+import struct
+import tempfile
+
+# A program for $c000 that waits for the PPU to warm up, enables NMI and rendering, then loops doing arithmetic
+# on zero page and storing through an indexed address, while the NMI handler scrolls the screen.
+PROGRAM = bytes([
+    0x78,                    # c000: SEI
+    0xd8,                    # c001: CLD
+    0xa2, 0xff,              # c002: LDX #$ff
+    0x9a,                    # c004: TXS
+    0x2c, 0x02, 0x20,        # c005: BIT $2002
+    0x10, 0xfb,              # c008: BPL $c005
+    0x2c, 0x02, 0x20,        # c00a: BIT $2002
+    0x10, 0xfb,              # c00d: BPL $c00a
+    0xa9, 0x80,              # c00f: LDA #$80
+    0x8d, 0x00, 0x20,        # c011: STA $2000
+    0xa9, 0x1e,              # c014: LDA #$1e
+    0x8d, 0x01, 0x20,        # c016: STA $2001
+    0xe6, 0x10,              # c019: INC $10
+    0xa5, 0x10,              # c01b: LDA $10
+    0x69, 0x03,              # c01d: ADC #3
+    0x85, 0x11,              # c01f: STA $11
+    0x0a,                    # c021: ASL A
+    0x45, 0x11,              # c022: EOR $11
+    0x9d, 0x00, 0x03,        # c024: STA $0300,X
+    0xca,                    # c027: DEX
+    0x20, 0x2e, 0xc0,        # c028: JSR $c02e
+    0x4c, 0x19, 0xc0,        # c02b: JMP $c019
+    0x66, 0x11,              # c02e: ROR $11
+    0x38,                    # c030: SEC
+    0xe9, 0x01,              # c031: SBC #1
+    0x60,                    # c033: RTS
+    0x48,                    # c034: PHA
+    0xe6, 0x12,              # c035: INC $12
+    0xa5, 0x12,              # c037: LDA $12
+    0x8d, 0x05, 0x20,        # c039: STA $2005
+    0xa9, 0x00,              # c03c: LDA #0
+    0x8d, 0x05, 0x20,        # c03e: STA $2005
+    0x68,                    # c041: PLA
+    0x40,                    # c042: RTI
+])
+RESET = 0xc000
+NMI = 0xc034
+
+
+def ines(prg, chr=b'', mapper=0, vertical=False):
+    """
+    An iNES image of the given PRG and CHR ROM, which must be whole 16KB and 8KB pages.
+    """
+    flags6 = ((mapper & 0xf) << 4) | vertical
+    header = b"NES\x1a" + bytes([len(prg) // 0x4000, len(chr) // 0x2000, flags6, mapper & 0xf0]) + bytes(8)
+    return header + bytes(prg) + bytes(chr)
+
+
+def prg_pages(count, program=b'', at=RESET, nmi=NMI, reset=RESET):
+    """
+    `count` 16KB PRG ROM pages, each filled with its own page number. The last holds `program` at `at` and the
+    vectors.
+    """
+    prg = bytearray()
+    for page in range(count):
+        prg += bytes([page]) * 0x4000
+    last = (count - 1) * 0x4000
+    prg[last + (at & 0x3fff):last + (at & 0x3fff) + len(program)] = program
+    prg[last + 0x3ffa:last + 0x4000] = struct.pack("<HHH", nmi, reset, reset)
+    return prg
+
+
+def chr_banks(count):
+    """
+    `count` 1KB CHR ROM banks, each filled with its own bank number.
+    """
+    return b"".join(bytes([bank]) * 0x400 for bank in range(count))
+
+
+def write_rom(image):
+    """
+    Save an image to a temporary .nes file and return its name. The caller removes it.
+    """
+    handle, filename = tempfile.mkstemp(suffix=".nes")
+    with os.fdopen(handle, 'wb') as f:
+        f.write(image)
+    return filename
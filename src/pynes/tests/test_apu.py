@@ -0,0 +1,164 @@
+import unittest
+from types import SimpleNamespace
+import numpy as np
+from papu import Papu, CPU_CLOCK, FRAME_STEPS, LENGTHS, SAMPLE_RATE
+
+# CPU cycles in one second of NTSC time
+SECOND = CPU_CLOCK
+
+
+def apu_console():
+    """
+    Just enough of a Console for a Papu: a CPU whose interrupt lines are a set, memory that reads zero and a
+    scheduler clock the test moves by hand.
+    """
+    lines = set()
+    cpu = SimpleNamespace(IRQ_FRAME_COUNTER=1, IRQ_DMC=2, assert_interrupt=lines.add, release_interrupt=lines.discard,
+                          memory=SimpleNamespace(read=lambda address: 0), lines=lines)
+    return SimpleNamespace(CPU=cpu, scheduler=SimpleNamespace(clock=0))
+
+
+class APUTest(unittest.TestCase):
+    def setUp(self):
+        self.console = apu_console()
+        self.apu = Papu(self.console)
+        self.lines = self.console.CPU.lines
+
+    def write(self, address, value, cycle=None):
+        if cycle is not None:
+            self.console.scheduler.clock = cycle
+        self.apu.register_write(address, value)
+
+    def read_status(self, cycle=None):
+        if cycle is not None:
+            self.console.scheduler.clock = cycle
+        return self.apu.read_status()
+
+    def samples(self, cycles):
+        """
+        The mixed output over the next `cycles` CPU cycles.
+        """
+        blocks = []
+        self.apu.add_sample_listener(blocks.append)
+        self.apu.flush(self.console.scheduler.clock + cycles)
+        return np.concatenate(blocks)
+
+
+class PitchTest(APUTest):
+    """
+    The pulse sequencer steps every timer + 1 APU cycles and has 8 steps; the triangle steps every timer + 1 CPU
+    cycles and has 32. A timer of 253 on pulse and 126 on triangle are both A440, at 440.4Hz.
+    """
+    def frequency(self, samples):
+        # Periods per second between the first and last rising crossing of the midpoint
+        high = samples > (samples.min() + samples.max()) / 2
+        rising = np.flatnonzero(high[1:] & ~high[:-1])
+        return (len(rising) - 1) * SAMPLE_RATE / (rising[-1] - rising[0])
+
+    def test_pulse(self):
+        self.write(0x4015, 0x01)
+        # 50% duty, halted length counter, constant volume 15
+        self.write(0x4000, 0xbf)
+        self.write(0x4002, 253 & 0xff)
+        self.write(0x4003, 253 >> 8)
+        self.assertAlmostEqual(self.frequency(self.samples(SECOND)), CPU_CLOCK / (16 * 254), delta=0.1)
+
+    def test_triangle(self):
+        self.write(0x4015, 0x04)
+        # Halted length counter, linear counter reload 127
+        self.write(0x4008, 0xff)
+        self.write(0x400a, 126)
+        self.write(0x400b, 0)
+        self.assertAlmostEqual(self.frequency(self.samples(SECOND)), CPU_CLOCK / (32 * 127), delta=0.1)
+
+
+class LengthCounterTest(APUTest):
+    def setUp(self):
+        APUTest.setUp(self)
+        # Keep the frame IRQ out of the $4015 reads.
+        self.write(0x4017, 0x40)
+
+    def load_pulse2(self, halt):
+        self.write(0x4015, 0x02)
+        self.write(0x4004, 0x30 if halt else 0x10)
+        # Length index 3 is 2 half frames
+        self.write(0x4007, 3 << 3)
+        self.assertEqual(self.apu.pulse2.length, LENGTHS[3])
+
+    def test_runs_out_after_two_half_frames(self):
+        self.load_pulse2(halt=False)
+        self.assertEqual(self.read_status(), 0x02)
+        self.assertEqual(self.read_status(FRAME_STEPS[0][1]), 0x02)
+        self.assertEqual(self.read_status(FRAME_STEPS[0][3]), 0x00)
+
+    def test_halt_holds_length(self):
+        self.load_pulse2(halt=True)
+        self.assertEqual(self.read_status(FRAME_STEPS[0][3] * 4), 0x02)
+
+    def test_disabling_clears_length(self):
+        self.load_pulse2(halt=True)
+        self.write(0x4015, 0x00)
+        self.assertEqual(self.read_status(), 0x00)
+        # Loading a disabled channel's length counter does nothing.
+        self.write(0x4007, 3 << 3)
+        self.assertEqual(self.read_status(), 0x00)
+
+
+class FrameCounterTest(APUTest):
+    def test_four_step_irq(self):
+        self.apu.catch_up(29828)
+        self.assertFalse(self.apu.frame_irq)
+        self.assertEqual(self.apu.next_event, 29829)
+        self.apu.catch_up(29829)
+        self.assertTrue(self.apu.frame_irq)
+        self.assertIn(self.console.CPU.IRQ_FRAME_COUNTER, self.lines)
+
+        # Reading $4015 reports the IRQ, then acknowledges it.
+        self.assertEqual(self.read_status(29830), 0x40)
+        self.assertNotIn(self.console.CPU.IRQ_FRAME_COUNTER, self.lines)
+        self.assertEqual(self.read_status(), 0x00)
+
+    def test_irq_inhibit(self):
+        self.write(0x4017, 0x40)
+        self.apu.catch_up(SECOND)
+        self.assertFalse(self.apu.frame_irq)
+
+    def test_five_step_clocks_immediately(self):
+        self.write(0x4015, 0x01)
+        self.write(0x4000, 0x00)
+        self.write(0x4003, 3 << 3)
+        self.write(0x4017, 0x80, cycle=100)
+        # The write itself is a half frame: length counter and envelope are clocked before any step is reached.
+        self.assertEqual(self.apu.pulse1.length, LENGTHS[3] - 1)
+        self.assertEqual(self.apu.pulse1.envelope.decay, 15)
+        self.assertEqual(self.apu.next_event, 100 + FRAME_STEPS[1][0])
+        # And the 5-step sequence never raises the frame IRQ.
+        self.apu.catch_up(SECOND)
+        self.assertFalse(self.apu.frame_irq)
+
+
+class DMCTest(APUTest):
+    def test_irq_at_last_fetch(self):
+        # IRQ enabled, no loop, the fastest rate (27 APU cycles a bit), and a 17 byte sample at $c000
+        self.write(0x4010, 0x8f)
+        self.write(0x4012, 0x00)
+        self.write(0x4013, 0x01)
+        self.write(0x4015, 0x10)
+        # The last byte is fetched when the 16 bytes before it have played, one APU cycle into the timer.
+        irq = (1 + 16 * 8 * 27) * 2
+        self.assertEqual(self.apu.next_event, irq)
+        self.apu.catch_up(irq - 1)
+        self.assertFalse(self.apu.dmc.irq)
+        self.apu.catch_up(irq)
+        self.assertTrue(self.apu.dmc.irq)
+        self.assertIn(self.console.CPU.IRQ_DMC, self.lines)
+
+        # Reading $4015 reports it without acknowledging; writing $4015 does.
+        self.assertEqual(self.read_status(irq) & 0x80, 0x80)
+        self.assertIn(self.console.CPU.IRQ_DMC, self.lines)
+        self.write(0x4015, 0x00)
+        self.assertNotIn(self.console.CPU.IRQ_DMC, self.lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
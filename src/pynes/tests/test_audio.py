@@ -0,0 +1,120 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+import numpy as np
+from audio import AudioCapture, BlipBuffer, RingBuffer
+from papu import SAMPLE_RATE
+
+# APU samples in one NTSC frame, and output samples at 44.1kHz
+FRAME = 29830
+RATE = 44100
+# Output samples until a step from silence has fully passed through the kernel
+SETTLE = 32
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_wraps_around(self):
+        ring = RingBuffer(8)
+        ring.write(np.arange(6))
+        np.testing.assert_array_equal(ring.read(4), [0, 1, 2, 3])
+        self.assertEqual(ring.write(np.arange(6, 12)), 6)
+        self.assertEqual(len(ring), 8)
+        np.testing.assert_array_equal(ring.read(8), np.arange(4, 12))
+        self.assertEqual((ring.overruns, ring.underruns), (0, 0))
+
+    def test_overrun_keeps_what_fits(self):
+        ring = RingBuffer(4)
+        self.assertEqual(ring.write(np.arange(1, 7)), 4)
+        self.assertEqual(ring.overruns, 1)
+        np.testing.assert_array_equal(ring.read(4), [1, 2, 3, 4])
+
+    def test_underrun_pads_with_silence(self):
+        ring = RingBuffer(4)
+        ring.write(np.array([5, 6]))
+        np.testing.assert_array_equal(ring.read(4), [5, 6, 0, 0])
+        self.assertEqual(ring.underruns, 1)
+        self.assertEqual(len(ring), 0)
+
+
+class BlipBufferTest(unittest.TestCase):
+    def resample(self, blocks):
+        blip = BlipBuffer(RATE)
+        return [blip.resample(block.astype(np.float32)) for block in blocks]
+
+    def test_output_length_follows_rate_ratio(self):
+        sizes = [FRAME, 7457, 1, 0, 29829, 12345] * 10
+        output = self.resample(np.zeros(size) for size in sizes)
+        total = sum(len(block) for block in output)
+        self.assertLessEqual(abs(total - sum(sizes) * RATE / SAMPLE_RATE), 1)
+
+    def test_continuous_across_blocks(self):
+        # A constant level and a 440Hz tone: neither may jump where one block ends and the next begins.
+        times = np.arange(FRAME * 20) / SAMPLE_RATE
+        signals = {'constant': np.full(len(times), 0.3), 'tone': 0.2 * np.sin(2 * np.pi * 440 * times)}
+        # The steepest the tone gets between output samples
+        slope = 0.2 * 2 * np.pi * 440 / RATE
+        for name, signal in signals.items():
+            with self.subTest(signal=name):
+                output = np.concatenate(self.resample(np.split(signal, 20)))
+                # Past the onset, which is a step from silence
+                self.assertLess(np.abs(np.diff(output[SETTLE:])).max(), slope * 1.1)
+
+    def test_removes_dc_without_touching_tone(self):
+        times = np.arange(FRAME * 200) / SAMPLE_RATE
+        signal = 0.3 + 0.2 * np.sin(2 * np.pi * 440 * times)
+        output = self.resample(np.split(signal, 200))
+        means = [block.mean() for block in output]
+        self.assertTrue(means[1] > means[10] > means[50] > 0)
+        self.assertLess(abs(means[-1]), 0.01)
+        self.assertAlmostEqual(output[-1].max() - output[-1].min(), 0.4, delta=0.01)
+
+
+class AudioCaptureTest(unittest.TestCase):
+    """
+    A capture whose writer falls behind drops chunks without stalling, and hashes only what reaches the file.
+    """
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix=".raw")
+        os.close(handle)
+        handle, self.hashes = tempfile.mkstemp(suffix=".txt")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+        os.remove(self.hashes)
+
+    def test_drops_unwritten_chunks_from_hashes(self):
+        listeners = []
+        apu = SimpleNamespace(add_sample_listener=listeners.append)
+        capture = AudioCapture(apu, self.filename, hashes=self.hashes, chunk=0.001, queued=1)
+        # Hold the writer on its first chunk until every frame has been handed over.
+        release = threading.Event()
+        write = capture._write
+
+        def stalled(pcm):
+            release.wait()
+            write(pcm)
+        capture._write = stalled
+
+        times = np.arange(FRAME * 10) / SAMPLE_RATE
+        for block in np.split((0.2 * np.sin(2 * np.pi * 440 * times)).astype(np.float32), 10):
+            listeners[0](block)
+        release.set()
+        capture.close()
+
+        self.assertGreater(capture.dropped, 0)
+        with open(self.filename, 'rb') as f:
+            written = f.read()
+        self.assertEqual(capture.digest.hexdigest(), hashlib.sha1(written).hexdigest())
+        with open(self.hashes) as f:
+            lines = f.read().split()
+        # One line per block actually written, each block a frame of samples give or take one
+        self.assertLess(len(lines), 10)
+        self.assertLessEqual(abs(len(written) // 2 - len(lines) * FRAME * RATE / SAMPLE_RATE), len(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import logging
+import os
+import unittest
+from cartridge import Cartridge
+from console import Console
+from cpu.blocks import BlockCache
+from ppubenchmark import Recorder
+from tests import roms
+
+ENGINES = ('execute', 'dispatch', 'blocks')
+
+
+class BlockLockstepTest(unittest.TestCase):
+    """
+    The block translation cache has to leave the CPU, RAM and the timing of every PPU access exactly as the
+    interpreters do.
+    """
+    def setUp(self):
+        logging.getLogger("PyNES").setLevel(logging.WARNING)
+        self.filename = roms.write_rom(roms.ines(roms.prg_pages(1, roms.PROGRAM), roms.chr_banks(8)))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def console(self, engine):
+        console = Console(Cartridge(self.filename))
+        if engine == 'blocks':
+            console.CPU.blocks = BlockCache(console.CPU)
+        else:
+            console.CPU.interpreter = getattr(console.CPU, engine)
+        return console
+
+    @staticmethod
+    def state(console):
+        registers = console.CPU.registers
+        return ((registers.pc, registers.a, registers.x, registers.y, registers.sp, registers.pack_status()),
+                bytes(console.CPU.memory._ram), console.scheduler.clock)
+
+    def test_frames_match_interpreters(self):
+        consoles = {engine: self.console(engine) for engine in ENGINES}
+        recorders = {engine: Recorder(console) for engine, console in consoles.items()}
+        for frame in range(30):
+            states = {}
+            for engine, console in consoles.items():
+                console.run_frame()
+                states[engine] = self.state(console)
+            self.assertEqual(states['blocks'], states['dispatch'], "frame {0}".format(frame))
+            self.assertEqual(states['execute'], states['dispatch'], "frame {0}".format(frame))
+        self.assertGreater(consoles['blocks'].CPU.blocks.translated, 0)
+        self.assertEqual(recorders['blocks'].events, recorders['dispatch'].events)
+        self.assertGreater(len(recorders['dispatch'].events), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import logging
+import os
+import unittest
+from cartridge import Cartridge
+from console import Console
+from tests import roms
+
+
+class ResetVectorTest(unittest.TestCase):
+    """
+    Every registered board maps PRG ROM so that the CPU finds the reset vector at power on, whatever the ROM size.
+    """
+    def setUp(self):
+        logging.getLogger("PyNES").setLevel(logging.WARNING)
+
+    def console(self, mapper, pages, chr_banks=8):
+        filename = roms.write_rom(roms.ines(roms.prg_pages(pages), roms.chr_banks(chr_banks), mapper))
+        try:
+            return Console(Cartridge(filename))
+        finally:
+            os.remove(filename)
+
+    def assert_reset_vector(self, console):
+        memory = console.CPU.memory
+        self.assertEqual(memory.read(0xfffc) | (memory.read(0xfffd) << 8), roms.RESET)
+
+    def test_nrom_128(self):
+        self.assert_reset_vector(self.console(0, 1))
+
+    def test_nrom_256(self):
+        self.assert_reset_vector(self.console(0, 2))
+
+    def test_uxrom(self):
+        self.assert_reset_vector(self.console(2, 8))
+
+    def test_cnrom(self):
+        self.assert_reset_vector(self.console(3, 1, 32))
+
+    def test_mmc1(self):
+        for pages in (1, 2, 8):
+            with self.subTest(pages=pages):
+                self.assert_reset_vector(self.console(1, pages, 32))
+
+    def test_mmc1_32kb_mode_mirrors_16kb_prg(self):
+        console = self.console(1, 1, 32)
+        # Serially write 0 to the control register: one-screen mirroring and 32KB PRG banks.
+        for bit in range(5):
+            console.Cart.mapper.mem_write(0x8000, 0)
+        self.assertEqual(console.Cart.mapper.loaded_pages, [0, 0])
+        self.assert_reset_vector(console)
+        self.assertEqual(console.CPU.memory.read(0x8000), 0)
+
+    def test_mmc1_32kb_mode_wraps_bank(self):
+        console = self.console(1, 4, 32)
+        mapper = console.Cart.mapper
+        for bit in range(5):
+            mapper.mem_write(0x8000, 0)
+        # PRG bank 6 is 32KB bank 3, past the two the ROM has.
+        for bit in range(5):
+            mapper.mem_write(0xe000, (6 >> bit) & 1)
+        self.assertEqual(mapper.loaded_pages, [2, 3])
+        self.assertEqual(console.CPU.memory.read(0x8000), 2)
+        self.assert_reset_vector(console)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from types import SimpleNamespace
+from audio import RingBuffer
+from pacing import FramePacer, FRAME_RATE, HISTOGRAM_BUCKETS
+
+FRAME = 1 / FRAME_RATE
+
+
+class FakeClock:
+    """
+    A clock that only moves when told to, and a console whose frames take `cost` seconds of it.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.cost = 0.0
+        self.console = SimpleNamespace(run_frame=self.run_frame)
+
+    def __call__(self):
+        return self.now
+
+    def run_frame(self):
+        self.now += self.cost
+
+
+class ClockPacingTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pacer = FramePacer(self.clock.console, max_catch_up=4, clock=self.clock)
+
+    def test_first_frame_is_due_at_once(self):
+        self.assertEqual(self.pacer.due(), 1)
+
+    def test_catch_up_is_capped_and_skips_ahead(self):
+        self.assertEqual(self.pacer.tick(), 1)
+        # Ten more frames fall due at once: four are run and the other six are given up on.
+        self.clock.now = 10.5 * FRAME
+        self.assertEqual(self.pacer.tick(), 4)
+        self.assertEqual(self.pacer.dropped, 6)
+        self.assertEqual(self.pacer._scheduled, 11)
+        self.assertEqual(self.pacer.frames, 5)
+        self.assertEqual(self.pacer.due(), 0)
+        self.clock.now = 11 * FRAME
+        self.assertEqual(self.pacer.due(), 1)
+
+    def test_late_frames(self):
+        self.clock.cost = 0.5 * FRAME
+        self.pacer.tick()
+        self.assertEqual(self.pacer.late, 0)
+        # Frame 1 is due at one frame time and finishes after frame 2 is due.
+        self.clock.now = FRAME
+        self.clock.cost = 1.5 * FRAME
+        self.pacer.tick()
+        self.assertEqual(self.pacer.late, 1)
+
+    def test_drift(self):
+        self.assertEqual(self.pacer.drift(), 0.0)
+        for _ in range(3):
+            self.pacer.run_frame()
+        self.clock.now = 2 * FRAME
+        self.assertAlmostEqual(self.pacer.drift(), FRAME)
+        self.clock.now = 5 * FRAME
+        self.assertAlmostEqual(self.pacer.drift(), -2 * FRAME)
+
+    def test_report_percentiles(self):
+        # Eight frames in the 2ms bucket, one in the 20ms bucket and one past the last bucket
+        for cost in [0.0025] * 8 + [0.0205, 0.1]:
+            self.clock.cost = cost
+            self.pacer.run_frame()
+        self.assertEqual(self.pacer.histogram[2], 8)
+        self.assertEqual(self.pacer.histogram[20], 1)
+        self.assertEqual(self.pacer.histogram[HISTOGRAM_BUCKETS], 1)
+        lines = self.pacer.report().splitlines()
+        self.assertTrue(lines[0].startswith("10 frames, "))
+        self.assertEqual(lines[1:], ["  p50 frame time < 3 ms",
+                                     "  p90 frame time < 21 ms",
+                                     "  p99 frame time >= {0} ms".format(HISTOGRAM_BUCKETS)])
+
+
+class AudioPacingTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.audio = SimpleNamespace(rate=44100, ring=RingBuffer(4410))
+        self.pacer = FramePacer(self.clock.console, audio=self.audio, max_catch_up=8, fill=0.5, clock=self.clock)
+        self.per_frame = 44100 / FRAME_RATE
+
+    def test_due_fills_the_ring_to_target(self):
+        # 2205 samples short, just over three frames' worth
+        self.assertEqual(self.pacer.due(), 4)
+        self.audio.ring.write([0] * 1000)
+        self.assertEqual(self.pacer.due(), 2)
+        self.audio.ring.write([0] * int(2 * self.per_frame))
+        self.assertEqual(self.pacer.due(), 0)
+
+    def test_never_drops(self):
+        self.pacer.max_catch_up = 2
+        self.clock.now = 100.0
+        self.assertEqual(self.pacer.due(), 2)
+        self.clock.now = 200.0
+        self.assertEqual(self.pacer.tick(), 2)
+        self.assertEqual(self.pacer.dropped, 0)
+        self.assertEqual(self.pacer.late, 0)
+        self.assertIn("0 audio underruns, 0 overruns", self.pacer.report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import logging
+import os
+import unittest
+from cartridge import Cartridge
+from console import Console
+from tests import roms
+
+
+class PatternWriteTest(unittest.TestCase):
+    """
+    $2007 writes to pattern table addresses only land when the cartridge has CHR RAM.
+    """
+    def setUp(self):
+        logging.getLogger("PyNES").setLevel(logging.WARNING)
+
+    def write_pattern(self, chr):
+        filename = roms.write_rom(roms.ines(roms.prg_pages(1), chr))
+        try:
+            ppu = Console(Cartridge(filename)).PPU
+        finally:
+            os.remove(filename)
+        ppu.write_register(6, 0x00)
+        ppu.write_register(6, 0x10)
+        ppu.write_register(7, 0xaa)
+        return ppu.memory
+
+    def test_chr_rom_is_read_only(self):
+        memory = self.write_pattern(roms.chr_banks(8))
+        self.assertEqual(memory.chr[0x10], 0)
+        self.assertFalse(memory.stale_tiles)
+
+    def test_chr_ram_is_written(self):
+        memory = self.write_pattern(b'')
+        self.assertEqual(memory.chr[0x10], 0xaa)
+        self.assertIn(1, memory.stale_tiles)
+
+
+if __name__ == '__main__':
+    unittest.main()
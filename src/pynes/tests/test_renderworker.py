@@ -0,0 +1,99 @@
+import logging
+import os
+import unittest
+from unittest import mock
+import numpy as np
+import renderworker
+from cartridge import Cartridge
+from console import Console
+from tests import roms
+
+# A CNROM program for $c000 that sets up a palette and shows the background, while the NMI handler selects CHR bank
+# 0 and then, partway down the next frame, bank 1. The bank numbers are written over equal ROM bytes, as the board
+# ANDs the two.
+PROGRAM = bytes([
+    0x78,                    # c000: SEI
+    0xd8,                    # c001: CLD
+    0xa2, 0xff,              # c002: LDX #$ff
+    0x9a,                    # c004: TXS
+    0x2c, 0x02, 0x20,        # c005: BIT $2002
+    0x10, 0xfb,              # c008: BPL $c005
+    0x2c, 0x02, 0x20,        # c00a: BIT $2002
+    0x10, 0xfb,              # c00d: BPL $c00a
+    0xa9, 0x3f,              # c00f: LDA #$3f
+    0x8d, 0x06, 0x20,        # c011: STA $2006
+    0xa9, 0x00,              # c014: LDA #0
+    0x8d, 0x06, 0x20,        # c016: STA $2006
+    0xa9, 0x0f,              # c019: LDA #$0f
+    0x8d, 0x07, 0x20,        # c01b: STA $2007
+    0xa9, 0x16,              # c01e: LDA #$16
+    0x8d, 0x07, 0x20,        # c020: STA $2007
+    0xa9, 0x27,              # c023: LDA #$27
+    0x8d, 0x07, 0x20,        # c025: STA $2007
+    0xa9, 0x30,              # c028: LDA #$30
+    0x8d, 0x07, 0x20,        # c02a: STA $2007
+    0xa9, 0x80,              # c02d: LDA #$80
+    0x8d, 0x00, 0x20,        # c02f: STA $2000
+    0xa9, 0x0a,              # c032: LDA #$0a
+    0x8d, 0x01, 0x20,        # c034: STA $2001
+    0x4c, 0x37, 0xc0,        # c037: JMP $c037
+    0xa9, 0x00,              # c03a: LDA #0
+    0x8d, 0x4f, 0xc0,        # c03c: STA $c04f
+    0xa0, 0x0b,              # c03f: LDY #11
+    0xa2, 0x00,              # c041: LDX #0
+    0xca,                    # c043: DEX
+    0xd0, 0xfd,              # c044: BNE $c043
+    0x88,                    # c046: DEY
+    0xd0, 0xf8,              # c047: BNE $c041
+    0xa9, 0x01,              # c049: LDA #1
+    0x8d, 0x50, 0xc0,        # c04b: STA $c050
+    0x40,                    # c04e: RTI
+    0x00, 0x01,              # c04f: bank numbers
+])
+NMI = 0xc03a
+
+FRAMES = 6
+
+
+class RenderWorkerTest(unittest.TestCase):
+    """
+    Frames drawn by the worker process match those drawn in process, one frame later, including CHR switched by
+    the mapper partway down the picture.
+    """
+    def setUp(self):
+        logging.getLogger("PyNES").setLevel(logging.WARNING)
+        self.filename = roms.write_rom(roms.ines(roms.prg_pages(1, PROGRAM, nmi=NMI), roms.chr_banks(16), mapper=3))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def frames(self, worker):
+        console = Console(Cartridge(self.filename))
+        if worker:
+            console.PPU.start_worker()
+        frames = []
+        try:
+            for frame in range(FRAMES):
+                console.run_frame()
+                frames.append(console.PPU.rgb.copy())
+        finally:
+            console.PPU.stop_worker()
+        return frames
+
+    def assert_frames_match(self):
+        drawn = self.frames(False)
+        # Bank 0 tiles are blank and bank 1 tiles are not, so the switch shows up partway down the picture.
+        self.assertFalse(np.array_equal(drawn[-1][0], drawn[-1][-1]))
+        for frame, rgb in enumerate(self.frames(True)):
+            np.testing.assert_array_equal(rgb, drawn[max(frame - 1, 0)])
+
+    def test_worker_matches_in_process(self):
+        self.assert_frames_match()
+
+    def test_overflowing_log_drawn_in_process(self):
+        with mock.patch.object(renderworker, 'MAX_LOG', 0):
+            self.assert_frames_match()
+
+
+if __name__ == '__main__':
+    unittest.main()